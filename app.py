@@ -1,22 +1,45 @@
-from flask import Flask, render_template_string, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
 import subprocess
 import os
 import json
+import re
 import shutil
+import stat
 from datetime import datetime
 import threading
 import asyncio
+import sys
+import importlib.util
+import fcntl
+import functools
 import requests
 import zipfile
+import gzip
+import mmap
+import struct
+import atexit
+import sqlite3
+from contextlib import contextmanager
+import zlib
 import tempfile
-from aiogram import Bot, Dispatcher, types, F
+import uuid
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from aiogram import Bot, Dispatcher, BaseMiddleware, types, F
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 import logging
 import hashlib
+import fnmatch
+import mimetypes
 import time
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -28,8 +51,17 @@ app.config['SECRET_KEY'] = 'deploy-manager-pro-secret-key-v4'
 # Конфигурация
 PROJECTS_DIR = "/app/projects"
 CONFIG_FILE = "/app/config/config.json"
+DB_FILE = "/app/config/deploy.db"
+PROJECT_LOGS_DIR = "/app/config/logs"
 LOG_FILE = "/app/config/deploy.log"
+JOBS_FILE = "/app/config/jobs.json"
 UPLOADS_DIR = "/app/uploads"
+MANIFESTS_DIR = "/app/config/manifests"
+ARCHIVE_CACHE_DIR = "/app/cache/archives"
+VENVS_DIR = "/app/venvs"
+WHEELHOUSE_DIR = "/app/cache/wheelhouse"
+COUNTERS_FILE = "/app/config/counters.bin"
+PROJECT_LOCKS_DIR = "/app/config/locks"
 BOT_TOKEN = os.getenv('BOT_TOKEN', '7966969765:AAEZLNOFRmv2hPJ8fQaE3u2KSPsoxreDn-E')
 ADMIN_IDS = [1769269442]
 
@@ -37,8 +69,107 @@ ADMIN_IDS = [1769269442]
 FLASK_PORT = int(os.getenv('PORT', 3000))
 FLASK_HOST = '0.0.0.0'
 
+# HTTP-сервер: dev - встроенный сервер Flask в потоке бота, gunicorn - отдельные процессы-воркеры
+HTTP_SERVER = os.getenv('HTTP_SERVER', 'dev')
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', 4))
+WEB_THREADS = int(os.getenv('WEB_THREADS', 8))
+WEB_TIMEOUT = int(os.getenv('WEB_TIMEOUT', 60))
+WEB_GRACEFUL_TIMEOUT = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 30))
+WEB_KEEPALIVE = int(os.getenv('WEB_KEEPALIVE', 5))
+
+# Настройки загрузки архивов
+DOWNLOAD_CHUNK_SIZE = int(os.getenv('DOWNLOAD_CHUNK_SIZE', 64 * 1024))
+MAX_ARCHIVE_SIZE_MB = int(os.getenv('MAX_ARCHIVE_SIZE_MB', 500))
+# incremental - запись только изменённых файлов, full - полная перезапись директории
+SYNC_MODE = os.getenv('DEPLOY_SYNC_MODE', 'incremental')
+ARCHIVE_CACHE_MAX_MB = int(os.getenv('ARCHIVE_CACHE_MAX_MB', 1024))
+
+# Виртуальные окружения проектов: включение и размер пула заранее созданных venv
+PROJECT_VENVS = os.getenv('PROJECT_VENVS', '1') == '1'
+VENV_POOL_SIZE = int(os.getenv('VENV_POOL_SIZE', 2))
+
+# Общий локальный склад wheel-пакетов
+WHEELHOUSE_ENABLED = os.getenv('WHEELHOUSE_ENABLED', '1') == '1'
+WHEELHOUSE_INDEX_URL = os.getenv('WHEELHOUSE_INDEX_URL', '')
+WHEELHOUSE_MAX_MB = int(os.getenv('WHEELHOUSE_MAX_MB', 2048))
+WHEELHOUSE_MAX_AGE_DAYS = int(os.getenv('WHEELHOUSE_MAX_AGE_DAYS', 30))
+
+# Ротация общего журнала: размер файла, число сжатых архивов и срок их хранения
+LOG_MAX_MB = int(os.getenv('LOG_MAX_MB', 10))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 10))
+LOG_RETENTION_DAYS = int(os.getenv('LOG_RETENTION_DAYS', 30))
+
+# Журналы проектов: размер сегмента и сколько сегментов хранить
+PROJECT_LOG_SEGMENT_KB = int(os.getenv('PROJECT_LOG_SEGMENT_KB', 256))
+PROJECT_LOG_MAX_SEGMENTS = int(os.getenv('PROJECT_LOG_MAX_SEGMENTS', 20))
+
+# Очередь деплоев: размер пула воркеров и таймауты этапов (секунды)
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+JOB_DRAIN_TIMEOUT = int(os.getenv('JOB_DRAIN_TIMEOUT', 60))
+JOB_CANCEL_WAIT_SECONDS = float(os.getenv('JOB_CANCEL_WAIT_SECONDS', 30))
+JOBS_HISTORY_LIMIT = int(os.getenv('JOBS_HISTORY_LIMIT', 200))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1.0))
+STAGE_TIMEOUTS = {
+    "download": int(os.getenv('STAGE_TIMEOUT_DOWNLOAD', 300)),
+    "extract": int(os.getenv('STAGE_TIMEOUT_EXTRACT', 120)),
+    "install": int(os.getenv('STAGE_TIMEOUT_INSTALL', 300)),
+}
+
+# Счётчики в общей памяти: слабы процессов, слоты имён, период сброса на диск
+COUNTER_SLABS = int(os.getenv('COUNTER_SLABS', 64))
+COUNTER_SLOTS = int(os.getenv('COUNTER_SLOTS', 4096))
+COUNTERS_FLUSH_SECONDS = int(os.getenv('COUNTERS_FLUSH_SECONDS', 30))
+
+# Список файлов проекта: размер страницы по умолчанию и максимальный
+FILES_PAGE_LIMIT = int(os.getenv('FILES_PAGE_LIMIT', 500))
+FILES_PAGE_MAX = int(os.getenv('FILES_PAGE_MAX', 5000))
+
+# Страницы списка проектов: API (по умолчанию / максимум) и бот
+PROJECTS_PAGE_LIMIT = int(os.getenv('PROJECTS_PAGE_LIMIT', 50))
+PROJECTS_PAGE_MAX = int(os.getenv('PROJECTS_PAGE_MAX', 500))
+BOT_PROJECTS_PAGE_SIZE = int(os.getenv('BOT_PROJECTS_PAGE_SIZE', 6))
+
+# Сжатие ответов: минимальный размер тела и уровни для динамических ответов (brotli - если установлен)
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 1024))
+COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', 5))
+COMPRESS_MIMETYPES = {
+    'text/html', 'text/plain', 'text/css', 'text/javascript', 'text/event-stream', 'application/json',
+    'application/x-ndjson', 'application/javascript'
+}
+
+# Кэш агрегатов (статистика, список проектов): время свежести и сколько ещё отдавать устаревшее при фоновом обновлении
+AGGREGATE_CACHE_TTL = float(os.getenv('AGGREGATE_CACHE_TTL', 30))
+AGGREGATE_CACHE_STALE_SECONDS = float(os.getenv('AGGREGATE_CACHE_STALE_SECONDS', 300))
+
+# Webhook: окно объединения пушей в один деплой и срок хранения ID доставок
+WEBHOOK_DEBOUNCE_SECONDS = float(os.getenv('WEBHOOK_DEBOUNCE_SECONDS', 10))
+# Объединение не откладывает запуск дольше чем на столько окон от первого запроса (поток частых пушей)
+COALESCE_MAX_DELAYS = int(os.getenv('COALESCE_MAX_DELAYS', 6))
+WEBHOOK_DELIVERY_TTL_HOURS = int(os.getenv('WEBHOOK_DELIVERY_TTL_HOURS', 24))
+
+# Массовое обновление: максимум параллельных проектов и адаптация к задержкам GitHub
+UPDATE_ALL_CONCURRENCY = int(os.getenv('UPDATE_ALL_CONCURRENCY', 4))
+UPDATE_ALL_ADAPTIVE = os.getenv('UPDATE_ALL_ADAPTIVE', '1') == '1'
+
+# Пул потоков для блокирующих операций бота и порог логирования медленных хендлеров
+BOT_BLOCKING_WORKERS = int(os.getenv('BOT_BLOCKING_WORKERS', 4))
+SLOW_HANDLER_SECONDS = float(os.getenv('SLOW_HANDLER_SECONDS', 1.0))
+
+# Поток событий SSE: размер буфера для переподключений и интервал пинга
+EVENT_BUFFER_SIZE = int(os.getenv('EVENT_BUFFER_SIZE', 1000))
+SSE_HEARTBEAT_SECONDS = int(os.getenv('SSE_HEARTBEAT_SECONDS', 15))
+EVENT_POLL_INTERVAL = float(os.getenv('EVENT_POLL_INTERVAL', 0.5))
+SSE_MAX_CONNECTION_SECONDS = int(os.getenv('SSE_MAX_CONNECTION_SECONDS', 300))
+DOWNLOAD_EVENT_INTERVAL = float(os.getenv('DOWNLOAD_EVENT_INTERVAL', 0.5))
+
+# Адреса GitHub (переопределяются для локального тестового сервера)
+GITHUB_URL = os.getenv('GITHUB_URL', 'https://github.com').rstrip('/')
+GITHUB_API_URL = os.getenv('GITHUB_API_URL', 'https://api.github.com').rstrip('/')
+GITHUB_TOKEN = os.getenv('GITHUB_TOKEN', '')
+
 # Создаём директории
-for dir_path in [PROJECTS_DIR, UPLOADS_DIR, "/app/config"]:
+for dir_path in [PROJECTS_DIR, UPLOADS_DIR, "/app/config", MANIFESTS_DIR, ARCHIVE_CACHE_DIR, VENVS_DIR, WHEELHOUSE_DIR, PROJECT_LOGS_DIR]:
     os.makedirs(dir_path, exist_ok=True)
 
 # Telegram Bot
@@ -47,17 +178,360 @@ dp = Dispatcher()
 
 # Глобальные переменные
 user_states = {}
-flask_running = False
-system_stats = {
-    "start_time": datetime.now(),
-    "deploys": 0,
-    "updates": 0,
-    "errors": 0
-}
+archive_cache_lock = threading.Lock()
+project_log_lock = threading.Lock()
+log_rotate_lock = threading.Lock()
+flask_running = os.getenv('DEPLOY_WEB_WORKER') == '1'
+bot_process = False
+process_started = datetime.now()
+
+# === ПОТОК СОБЫТИЙ (SSE) ===
+
+class EventBus:
+    """Поток событий через таблицу events: публикуют и читают все процессы (бот и веб-воркеры)"""
+    
+    def __init__(self, size):
+        self.size = size
+        self.condition = threading.Condition()
+    
+    @property
+    def last_id(self):
+        return get_db().execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+    
+    def publish(self, event_type, data):
+        try:
+            conn = get_db()
+            event_id = conn.execute(
+                "INSERT INTO events (type, data, created) VALUES (?, ?, ?)",
+                (event_type, json.dumps(data, ensure_ascii=False, default=str), time.time())
+            ).lastrowid
+            # Буфер нужен только для переподключений - старые события периодически удаляются
+            if event_id % 100 == 0:
+                conn.execute("DELETE FROM events WHERE id <= ?", (event_id - self.size,))
+        except Exception as e:
+            logger.error(f"Ошибка публикации события {event_type}: {e}")
+            return
+        with self.condition:
+            self.condition.notify_all()
+    
+    def wait(self, after_id, timeout):
+        """События новее after_id; если их нет - ожидание не дольше timeout
+        (события своего процесса будят сразу, других процессов - опросом)"""
+        deadline = time.monotonic() + timeout
+        while True:
+            rows = get_db().execute(
+                "SELECT id, type, data FROM events WHERE id > ? ORDER BY id LIMIT 500", (after_id,)
+            ).fetchall()
+            if rows:
+                return [(row["id"], row["type"], json.loads(row["data"])) for row in rows]
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+            with self.condition:
+                self.condition.wait(min(remaining, EVENT_POLL_INTERVAL))
+
+event_bus = EventBus(EVENT_BUFFER_SIZE)
+
+# === СЧЁТЧИКИ (общая память) ===
+
+class CounterStore:
+    """Счётчики в mmap-файле: у каждого процесса свой слаб, поэтому запись не требует
+    межпроцессных блокировок; значение счётчика - сумма по слабам, имена - в общей таблице файла"""
+    
+    MAGIC = b'DMCNT001'
+    HEADER_SIZE = 32    # magic, число слабов, число слотов, занято слотов
+    NAME_SIZE = 128
+    
+    def __init__(self, path, slabs, slots):
+        self.path = path
+        self.slabs = slabs
+        self.slots = slots
+        self.map = None
+        self.values = None
+        self.pid = None
+        self.slab = None
+        self.names = {}
+        self.lock = threading.Lock()
+    
+    def add(self, name, amount=1):
+        try:
+            with self.lock:
+                self._ensure_slab()
+                slot = self._slot(name, create=True)
+                self.values[self.data_at + self.slab * self.slots + slot] += int(amount)
+        except Exception as e:
+            logger.error(f"Ошибка счётчика {name}: {e}")
+    
+    def value(self, name):
+        with self.lock:
+            self._ensure_open()
+            slot = self._slot(name)
+        if slot is None:
+            return 0
+        end = self.data_at + self.slabs * self.slots
+        return sum(self.values[self.data_at + slot:end:self.slots])
+    
+    def snapshot(self, prefix=""):
+        """Все счётчики (с данным префиксом): {имя: сумма по процессам}"""
+        with self.lock:
+            self._ensure_open()
+            self._load_names()
+            names = {name: slot for name, slot in self.names.items() if name.startswith(prefix)}
+        if not names:
+            return {}
+        used = max(names.values()) + 1
+        totals = [0] * used
+        for slab in range(self.slabs):
+            start = self.data_at + slab * self.slots
+            for slot, value in enumerate(self.values[start:start + used].tolist()):
+                totals[slot] += value
+        return {name: totals[slot] for name, slot in names.items()}
+    
+    def flush(self):
+        if self.map is not None:
+            self.map.flush()
+    
+    def _ensure_open(self):
+        """Открытие (при первом обращении - создание) файла; размеры берутся из его заголовка"""
+        if self.map is not None:
+            return
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            header = os.pread(fd, self.HEADER_SIZE, 0)
+            if len(header) == self.HEADER_SIZE and header[:8] == self.MAGIC:
+                self.slabs, self.slots, _ = struct.unpack('<qqq', header[8:])
+            else:
+                os.ftruncate(fd, 0)
+                os.pwrite(fd, self.MAGIC + struct.pack('<qqq', self.slabs, self.slots, 0), 0)
+            
+            self.owners_at = self.HEADER_SIZE // 8
+            self.names_offset = self.HEADER_SIZE + self.slabs * 8
+            self.data_at = (self.names_offset + self.slots * self.NAME_SIZE) // 8
+            size = (self.data_at + self.slabs * self.slots) * 8
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            # mmap держит копию дескриптора, поэтому блокировка снимается явно
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        self.values = memoryview(self.map).cast('q')
+        threading.Thread(target=self._flush_loop, name="counters-flush", daemon=True).start()
+    
+    def _ensure_slab(self):
+        """Свой слаб: свободный или процесса, которого уже нет (его значения остаются в сумме)"""
+        self._ensure_open()
+        pid = os.getpid()
+        if self.pid == pid:
+            return
+        with self._file_lock():
+            for slab in range(self.slabs):
+                owner = self.values[self.owners_at + slab]
+                if owner in (0, pid) or not _pid_alive(owner):
+                    self.values[self.owners_at + slab] = pid
+                    self.slab, self.pid = slab, pid
+                    return
+        raise Exception("Нет свободных слабов счётчиков (увеличьте COUNTER_SLABS)")
+    
+    def _slot(self, name, create=False):
+        slot = self.names.get(name)
+        if slot is None:
+            self._load_names()
+            slot = self.names.get(name)
+        if slot is None and create:
+            with self._file_lock():
+                self._load_names()
+                slot = self.names.get(name)
+                if slot is None:
+                    slot = self._used_slots()
+                    encoded = name.encode('utf-8')
+                    if slot >= self.slots or len(encoded) > self.NAME_SIZE:
+                        raise Exception("Нет места для нового счётчика (COUNTER_SLOTS)")
+                    # Сначала имя, потом счётчик занятых слотов: читатели не увидят пустое имя
+                    offset = self.names_offset + slot * self.NAME_SIZE
+                    self.map[offset:offset + self.NAME_SIZE] = encoded.ljust(self.NAME_SIZE, b'\0')
+                    self.values[3] = slot + 1
+                    self.names[name] = slot
+        return slot
+    
+    def _used_slots(self):
+        return self.values[3]
+    
+    def _load_names(self):
+        """Дочитывание имён, добавленных другими процессами"""
+        for slot in range(len(self.names), self._used_slots()):
+            offset = self.names_offset + slot * self.NAME_SIZE
+            self.names[self.map[offset:offset + self.NAME_SIZE].rstrip(b'\0').decode('utf-8')] = slot
+    
+    @contextmanager
+    def _file_lock(self):
+        fd = os.open(self.path, os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+    
+    def _flush_loop(self):
+        while True:
+            time.sleep(COUNTERS_FLUSH_SECONDS)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка сброса счётчиков на диск: {e}")
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+counter_store = CounterStore(COUNTERS_FILE, COUNTER_SLABS, COUNTER_SLOTS)
+atexit.register(counter_store.flush)
+
+def count_event(name, amount=1, project=None):
+    """Увеличение счётчика и его разбивки по проекту"""
+    counter_store.add(name, amount)
+    if project:
+        counter_store.add(f"project:{project}:{name}", amount)
+
+def get_project_counters():
+    """Счётчики в разрезе проектов: {проект: {счётчик: значение}}"""
+    breakdown = {}
+    for key, value in counter_store.snapshot("project:").items():
+        _, project, name = key.split(":", 2)
+        breakdown.setdefault(project, {})[name] = value
+    return breakdown
+
+# === МЕТРИКИ (Prometheus) ===
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTES_BUCKETS = tuple(1024 * 4 ** power for power in range(1, 10))  # 4 KB ... 256 MB
+metrics_registry = []
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+class Histogram:
+    """Гистограмма Prometheus: счётчики по корзинам, сумма и количество для каждого набора меток"""
+    
+    def __init__(self, name, help_text, labels=(), buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+        metrics_registry.append(self)
+    
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+    
+    @contextmanager
+    def time(self, *label_values):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, *label_values)
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            snapshot = {key: (list(counts), total, count) for key, (counts, total, count) in self.series.items()}
+        for label_values, (counts, total, count) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (None,), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound is None else repr(float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, [('le', le)])} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class CallbackMetric:
+    """Счётчик или gauge, значения которого читаются при сборе: collect() -> {значения меток: число}"""
+    
+    def __init__(self, name, help_text, metric_type, labels, collect):
+        self.name = name
+        self.help_text = help_text
+        self.metric_type = metric_type
+        self.labels = labels
+        self.collect = collect
+        metrics_registry.append(self)
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        for label_values, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+def render_metrics():
+    lines = []
+    for metric in metrics_registry:
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            logger.error(f"Ошибка сбора метрики {metric.name}: {e}")
+    return "\n".join(lines) + "\n"
+
+http_request_seconds = Histogram(
+    "deploy_http_request_seconds", "Время обработки HTTP-запроса", ("method", "route", "status")
+)
+github_download_seconds = Histogram("deploy_github_download_seconds", "Время скачивания архива с GitHub")
+github_download_bytes = Histogram(
+    "deploy_github_download_bytes", "Размер скачанного архива", buckets=BYTES_BUCKETS
+)
+extract_seconds = Histogram("deploy_extract_seconds", "Время распаковки и синхронизации архива")
+pip_install_seconds = Histogram("deploy_pip_install_seconds", "Время установки зависимостей", ("outcome",))
+job_seconds = Histogram("deploy_job_seconds", "Полное время выполнения задачи очереди", ("kind", "status"))
+bot_handler_seconds = Histogram("deploy_bot_handler_seconds", "Время выполнения хендлера бота", ("handler",))
+
+def _collect_counters():
+    values = {}
+    for key, value in counter_store.snapshot().items():
+        if key.startswith("project:"):
+            _, project, name = key.split(":", 2)
+            values[(name, project)] = value
+        else:
+            values[(key, "")] = value
+    return values
+
+CallbackMetric(
+    "deploy_counter_total", "Накопительные счётчики (project пуст - итог по всем проектам)", "counter",
+    ("counter", "project"), _collect_counters
+)
+CallbackMetric(
+    "deploy_jobs", "Задачи очереди деплоев по статусу", "gauge", ("status",),
+    lambda: {(status,): count for status, count in job_queue.status_counts().items()}
+)
+CallbackMetric(
+    "deploy_bot_loop_lag_seconds", "Последняя задержка event loop бота", "gauge", (),
+    lambda: {(): get_bot_latency_summary()["loop_lag_last"]}
+)
 
 # === MIDDLEWARE ===
 @app.before_request
 def log_request_info():
+    request.environ['deploy.started'] = time.monotonic()
     logger.info(f"🌐 {request.method} {request.path} from {request.remote_addr}")
 
 @app.after_request
@@ -66,102 +540,1197 @@ def after_request(response):
     response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
     response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
     response.headers['X-Powered-By'] = 'Deploy Manager Pro v4.0'
-    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+    # Ответы с собственной политикой кэширования (ETag) её сохраняют
+    if 'Cache-Control' not in response.headers:
+        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+    response = compress_response(response)
+    
+    started = request.environ.get('deploy.started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        http_request_seconds.observe(time.monotonic() - started, request.method, route, str(response.status_code))
+    return response
+
+# === УСЛОВНЫЕ ОТВЕТЫ (ETag / 304) ===
+
+def make_etag(*parts):
+    """ETag из номеров версий данных, от которых зависит ответ"""
+    return hashlib.sha1(json.dumps(parts, default=str).encode('utf-8')).hexdigest()[:20]
+
+def conditional_response(etag, build):
+    """304 без построения тела, если у клиента та же версия; иначе ответ build() с ETag.
+    no-cache: браузер хранит ответ, но перед использованием проверяет его по ETag"""
+    # Слабое сравнение: сжатый ответ отдаётся со слабым ETag (W/"...")
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.make_response(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# === СЖАТИЕ ОТВЕТОВ (gzip / brotli) ===
+
+class StreamCompressor:
+    """Потоковый компрессор gzip/brotli с единым интерфейсом"""
+    
+    def __init__(self, encoding, level=None):
+        self.encoding = encoding
+        if encoding == 'br':
+            self.compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY if level is None else level)
+        else:
+            # wbits=31 - формат gzip (заголовок и CRC), а не голый deflate
+            self.compressor = zlib.compressobj(COMPRESS_GZIP_LEVEL if level is None else level, zlib.DEFLATED, 31)
+    
+    def compress(self, data, flush=False):
+        """Сжатие блока; flush=True выталкивает всё накопленное (нужно для стриминга)"""
+        if self.encoding == 'br':
+            out = self.compressor.process(data)
+            return out + self.compressor.flush() if flush else out
+        out = self.compressor.compress(data)
+        return out + self.compressor.flush(zlib.Z_SYNC_FLUSH) if flush else out
+    
+    def finish(self):
+        return self.compressor.finish() if self.encoding == 'br' else self.compressor.flush()
+
+def compress_bytes(data, encoding, level=None):
+    compressor = StreamCompressor(encoding, level)
+    return compressor.compress(data) + compressor.finish()
+
+def negotiate_encoding():
+    """Лучшее поддерживаемое кодирование из Accept-Encoding (None - без сжатия)"""
+    offered = ['br', 'gzip'] if brotli else ['gzip']
+    return request.accept_encodings.best_match(offered)
+
+def _compress_stream(original, encoding):
+    """Сжатие стримингового ответа: каждый блок выталкивается сразу, чтобы SSE/NDJSON не залипали в буфере"""
+    compressor = StreamCompressor(encoding)
+    try:
+        for chunk in original:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            if chunk:
+                out = compressor.compress(chunk, flush=True)
+                if out:
+                    yield out
+        yield compressor.finish()
+    finally:
+        close = getattr(original, 'close', None)
+        if close:
+            close()
+
+def compress_response(response):
+    """Сжатие ответа по Accept-Encoding; маленькие, уже сжатые и файловые ответы не трогаются"""
+    if response.mimetype not in COMPRESS_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    if (response.status_code < 200 or response.status_code in (204, 304) or request.method == 'HEAD'
+            or 'Content-Encoding' in response.headers or response.direct_passthrough):
+        return response
+    
+    encoding = negotiate_encoding()
+    if not encoding:
+        return response
+    
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_BYTES:
+            return response
+        response.set_data(compress_bytes(data, encoding))
+    
+    response.headers['Content-Encoding'] = encoding
+    # Сжатое представление побайтно отличается от исходного - ETag становится слабым
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+def precompressed_response(cache, body, mimetype):
+    """Ответ из заранее сжатых вариантов статичного тела (сжимаются один раз с максимальным уровнем)"""
+    encoding = negotiate_encoding()
+    if not encoding:
+        return app.response_class(body, mimetype=mimetype)
+    if encoding not in cache:
+        level = 11 if encoding == 'br' else 9
+        cache[encoding] = compress_bytes(body, encoding, level)
+    response = app.response_class(cache[encoding], mimetype=mimetype)
+    response.headers['Content-Encoding'] = encoding
     return response
 
 # === UTILITY FUNCTIONS ===
 
-def download_repo_from_github(repo_url, branch="main", target_dir=None):
-    """Скачивание репозитория через GitHub API"""
+def stream_download(url, dest_path, max_bytes=None, chunk_size=None, progress_callback=None, timeout=30):
+    """Потоковое скачивание файла на диск блоками фиксированного размера с подсчётом SHA-256"""
+    if max_bytes is None:
+        max_bytes = MAX_ARCHIVE_SIZE_MB * 1024 * 1024
+    chunk_size = chunk_size or DOWNLOAD_CHUNK_SIZE
+    
+    sha256 = hashlib.sha256()
+    downloaded = 0
+    started = time.monotonic()
+    
     try:
-        system_stats["deploys"] += 1
-        logger.info(f"Скачивание {repo_url}, ветка {branch}")
+        with requests.get(url, stream=True, timeout=timeout) as response:
+            if response.status_code != 200:
+                raise Exception(f"HTTP {response.status_code}")
+            
+            content_length = response.headers.get('Content-Length', '')
+            total = int(content_length) if content_length.isdigit() else None
+            if max_bytes and total and total > max_bytes:
+                raise Exception(f"Архив слишком большой: {total} байт (лимит {max_bytes})")
+            
+            with open(dest_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    if not chunk:
+                        continue
+                    downloaded += len(chunk)
+                    if max_bytes and downloaded > max_bytes:
+                        raise Exception(f"Архив превысил лимит {max_bytes} байт")
+                    
+                    f.write(chunk)
+                    sha256.update(chunk)
+                    
+                    if progress_callback:
+                        progress_callback(downloaded, total)
+    except Exception:
+        if os.path.exists(dest_path):
+            os.unlink(dest_path)
+        raise
+    
+    github_download_seconds.observe(time.monotonic() - started)
+    github_download_bytes.observe(downloaded)
+    return {"bytes": downloaded, "sha256": sha256.hexdigest()}
+
+def get_manifest_path(project_path):
+    """Путь к манифесту файлов проекта"""
+    project_key = os.path.basename(os.path.normpath(project_path))
+    return os.path.join(MANIFESTS_DIR, f"{project_key}.files.json")
+
+def load_manifest(project_path):
+    """Загрузка манифеста файлов проекта (None, если манифеста нет)"""
+    try:
+        with open(get_manifest_path(project_path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Манифест {project_path} повреждён: {e}")
+        return None
+
+def save_manifest(project_path, files):
+    """Атомарная запись манифеста файлов проекта"""
+    manifest_path = get_manifest_path(project_path)
+    temp_path = f"{manifest_path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(files, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(temp_path, manifest_path)
+
+def _file_checksums(file_path):
+    """CRC32 и SHA-256 файла на диске"""
+    crc = 0
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+            sha256.update(chunk)
+    return crc, sha256.hexdigest()
+
+def _remove_path(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+def _prune_empty_dirs(path, root):
+    """Удаление опустевших директорий вверх до корня проекта"""
+    path = os.path.dirname(path)
+    while os.path.normpath(path) != os.path.normpath(root):
+        try:
+            os.rmdir(path)
+        except OSError:
+            break
+        path = os.path.dirname(path)
+
+def _archive_members(zip_ref):
+    """Файлы архива без корневой папки GitHub: {относительный путь: ZipInfo}"""
+    members = {}
+    for info in zip_ref.infolist():
+        if info.is_dir() or '/' not in info.filename:
+            continue
+        rel_path = info.filename.split('/', 1)[1]
+        parts = rel_path.split('/')
+        if not rel_path or rel_path.startswith('/') or '..' in parts or '' in parts:
+            logger.warning(f"Пропущен небезопасный путь в архиве: {info.filename}")
+            continue
+        members[rel_path] = info
+    return members
+
+def summarize_manifest(files):
+    """Сводная статистика проекта по манифесту файлов"""
+    summary = {
+        "files_count": len(files),
+        "total_size": 0,
+        "python_files": 0,
+        "has_requirements": False,
+        "last_modified": None
+    }
+    for rel_path, entry in files.items():
+        file_name = rel_path.rsplit('/', 1)[-1]
+        summary["total_size"] += entry.get("size", 0)
+        if file_name.endswith('.py'):
+            summary["python_files"] += 1
+        elif file_name == 'requirements.txt':
+            summary["has_requirements"] = True
+        if entry.get("mtime") and (not summary["last_modified"] or entry["mtime"] > summary["last_modified"]):
+            summary["last_modified"] = entry["mtime"]
+    return summary
+
+def sync_archive_to_dir(zip_ref, target_dir, clean=False, checkpoint=None):
+    """Инкрементальная синхронизация архива с директорией проекта по размеру и хэшу из манифеста"""
+    os.makedirs(target_dir, exist_ok=True)
+    
+    if clean:
+        for item in os.listdir(target_dir):
+            _remove_path(os.path.join(target_dir, item))
+        old_files = {}
+    else:
+        old_files = load_manifest(target_dir)
+    
+    members = _archive_members(zip_ref)
+    new_files = {}
+    stats = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0}
+    
+    # Удаление - до записи: иначе путь, ставший каталогом (a/b -> a/b/c), удалялся бы вместе с новыми файлами
+    if old_files is not None:
+        removed = [rel_path for rel_path in old_files if rel_path not in members]
+    else:
+        # Без манифеста сохраняем прежнее поведение: удаляем всё, чего нет в архиве
+        removed = []
+        for root, dirs, files in os.walk(target_dir):
+            for file in files:
+                rel_path = os.path.relpath(os.path.join(root, file), target_dir).replace(os.sep, '/')
+                if rel_path not in members:
+                    removed.append(rel_path)
+    
+    for rel_path in removed:
+        file_path = os.path.join(target_dir, *rel_path.split('/'))
+        try:
+            _remove_path(file_path)
+            _prune_empty_dirs(file_path, target_dir)
+            stats["removed"] += 1
+        except Exception as e:
+            logger.warning(f"Не удалось удалить {rel_path}: {e}")
+    
+    for rel_path, info in members.items():
+        if checkpoint:
+            checkpoint()
+        dest_path = os.path.join(target_dir, *rel_path.split('/'))
+        entry = (old_files or {}).get(rel_path)
         
-        if "github.com" not in repo_url:
-            raise Exception("Поддерживается только GitHub")
+        try:
+            file_stat = os.stat(dest_path)
+            disk_size = file_stat.st_size if stat.S_ISREG(file_stat.st_mode) else None
+        except OSError:
+            disk_size = None
+        
+        if entry and entry.get('crc') == info.CRC and entry.get('size') == info.file_size == disk_size:
+            new_files[rel_path] = {**entry, "mtime": file_stat.st_mtime}
+            stats["unchanged"] += 1
+            continue
+        
+        if old_files is None and disk_size == info.file_size:
+            # Манифеста ещё нет - сверяем с файлом на диске без перезаписи
+            crc, sha256 = _file_checksums(dest_path)
+            if crc == info.CRC:
+                new_files[rel_path] = {
+                    "size": info.file_size, "crc": info.CRC, "sha256": sha256, "mtime": file_stat.st_mtime
+                }
+                stats["unchanged"] += 1
+                continue
+        
+        parent_dir = os.path.dirname(dest_path)
+        if os.path.lexists(parent_dir) and not os.path.isdir(parent_dir):
+            os.remove(parent_dir)
+        os.makedirs(parent_dir, exist_ok=True)
+        if os.path.isdir(dest_path):
+            shutil.rmtree(dest_path)
+        
+        sha256 = hashlib.sha256()
+        temp_path = f"{dest_path}.sync-tmp"
+        with zip_ref.open(info) as source, open(temp_path, 'wb') as target:
+            for chunk in iter(lambda: source.read(DOWNLOAD_CHUNK_SIZE), b''):
+                target.write(chunk)
+                sha256.update(chunk)
+        os.replace(temp_path, dest_path)
+        
+        new_files[rel_path] = {
+            "size": info.file_size, "crc": info.CRC, "sha256": sha256.hexdigest(),
+            "mtime": os.stat(dest_path).st_mtime
+        }
+        stats["changed" if disk_size is not None else "added"] += 1
+    
+    save_manifest(target_dir, new_files)
+    stats["summary"] = summarize_manifest(new_files)
+    return stats
+
+GITHUB_REPO_PATTERN = re.compile(
+    r'^(?:(?:https?|git|ssh)://)?(?:[^@/]+@)?(?:www\.)?github\.com[:/]+([^/\s]+)/([^/\s?#]+)',
+    re.IGNORECASE
+)
+
+def parse_github_repo(repo_url):
+    """Владелец и имя репозитория из GitHub URL (https/ssh, с .git и без, с хвостом пути)"""
+    if "github.com" not in repo_url.lower():
+        raise Exception("Поддерживается только GitHub")
+    
+    match = GITHUB_REPO_PATTERN.match(repo_url.strip())
+    if not match:
+        raise Exception("Неверный формат URL")
+    
+    owner, repo_name = match.groups()
+    if repo_name.lower().endswith('.git'):
+        repo_name = repo_name[:-len('.git')]
+    return owner, repo_name
+
+def normalize_repo_key(repo_url):
+    """Ключ 'owner/repo' в нижнем регистре или None, если это не GitHub URL"""
+    try:
+        owner, repo_name = parse_github_repo(repo_url)
+    except Exception:
+        return None
+    return f"{owner}/{repo_name}".lower()
+
+def get_deploy_state_path(project_path):
+    """Путь к файлу состояния деплоя проекта"""
+    project_key = os.path.basename(os.path.normpath(project_path))
+    return os.path.join(MANIFESTS_DIR, f"{project_key}.json")
+
+def load_deploy_state(project_path):
+    try:
+        with open(get_deploy_state_path(project_path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"Состояние деплоя {project_path} повреждено: {e}")
+        return {}
+
+def save_deploy_state(project_path, state):
+    state_path = get_deploy_state_path(project_path)
+    temp_path = f"{state_path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(temp_path, state_path)
+
+def _github_headers(extra=None):
+    headers = {"User-Agent": "Deploy-Manager-Pro"}
+    if GITHUB_TOKEN:
+        headers["Authorization"] = f"Bearer {GITHUB_TOKEN}"
+    headers.update(extra or {})
+    return headers
+
+def resolve_branch_sha(username, repo_name, branch):
+    """SHA последнего коммита ветки через условный запрос к GitHub API (None при ошибке)"""
+    refs_path = os.path.join(ARCHIVE_CACHE_DIR, "refs.json")
+    ref_key = f"{username}/{repo_name}@{branch}".lower()
+    
+    with archive_cache_lock:
+        try:
+            with open(refs_path, 'r', encoding='utf-8') as f:
+                refs = json.load(f)
+        except Exception:
+            refs = {}
+    cached = refs.get(ref_key, {})
+    
+    headers = {"Accept": "application/vnd.github.sha"}
+    if cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    
+    try:
+        response = requests.get(
+            f"{GITHUB_API_URL}/repos/{username}/{repo_name}/commits/{requests.utils.quote(branch, safe='/')}",
+            headers=_github_headers(headers),
+            timeout=10
+        )
+    except Exception as e:
+        logger.warning(f"Не удалось получить SHA ветки {ref_key}: {e}")
+        return None
+    
+    if response.status_code == 304 and cached.get("sha"):
+        return cached["sha"]
+    if response.status_code != 200:
+        logger.warning(f"Не удалось получить SHA ветки {ref_key}: HTTP {response.status_code}")
+        return None
+    
+    sha = response.text.strip()
+    if len(sha) != 40 or any(c not in "0123456789abcdef" for c in sha.lower()):
+        logger.warning(f"Некорректный SHA ветки {ref_key}: {sha[:50]}")
+        return None
+    
+    with archive_cache_lock:
+        try:
+            with open(refs_path, 'r', encoding='utf-8') as f:
+                refs = json.load(f)
+        except Exception:
+            refs = {}
+        refs[ref_key] = {"sha": sha, "etag": response.headers.get("ETag")}
+        with open(f"{refs_path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(refs, f, ensure_ascii=False)
+        os.replace(f"{refs_path}.tmp", refs_path)
+    
+    return sha
+
+def get_cached_archive_path(username, repo_name, branch, sha):
+    """Путь к архиву в кэше по ключу (репозиторий, ветка, коммит)"""
+    safe_branch = "".join(c if c.isalnum() or c in "-_." else "_" for c in branch)
+    return os.path.join(ARCHIVE_CACHE_DIR, f"{username}__{repo_name}__{safe_branch}__{sha}.zip".lower())
+
+def evict_archive_cache(max_bytes=None):
+    """LRU-вытеснение архивов из кэша при превышении лимита размера"""
+    if max_bytes is None:
+        max_bytes = ARCHIVE_CACHE_MAX_MB * 1024 * 1024
+    
+    with archive_cache_lock:
+        archives = []
+        for entry in os.scandir(ARCHIVE_CACHE_DIR):
+            if entry.is_file() and entry.name.endswith('.zip'):
+                entry_stat = entry.stat()
+                archives.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+        
+        total_size = sum(size for _, size, _ in archives)
+        for _, size, path in sorted(archives):
+            if total_size <= max_bytes:
+                break
+            try:
+                os.remove(path)
+                total_size -= size
+                logger.info(f"Архив вытеснен из кэша: {os.path.basename(path)}")
+            except OSError:
+                pass
+
+def fetch_archive(username, repo_name, branch, sha, progress_callback=None):
+    """Архив коммита из кэша или с GitHub; возвращает (путь, скачано байт)"""
+    cache_path = get_cached_archive_path(username, repo_name, branch, sha)
+    if os.path.exists(cache_path):
+        os.utime(cache_path)
+        logger.info(f"Архив {username}/{repo_name}@{sha[:7]} взят из кэша")
+        return cache_path, 0
+    
+    zip_url = f"{GITHUB_URL}/{username}/{repo_name}/archive/{sha}.zip"
+    fd, temp_path = tempfile.mkstemp(suffix='.zip.part', dir=ARCHIVE_CACHE_DIR)
+    os.close(fd)
+    
+    download = stream_download(zip_url, temp_path, progress_callback=progress_callback)
+    logger.info(f"Архив скачан: {download['bytes']} байт, sha256 {download['sha256']}")
+    os.replace(temp_path, cache_path)
+    
+    evict_archive_cache()
+    return cache_path, download['bytes']
+
+@contextmanager
+def project_lock(project):
+    """Эксклюзивная блокировка проекта на время синхронизации файлов или установки зависимостей.
+    flock на отдельном дескрипторе: исключает и другие потоки, и другие процессы (бот, воркеры gunicorn)"""
+    if not project:
+        yield
+        return
+    os.makedirs(PROJECT_LOCKS_DIR, exist_ok=True)
+    fd = os.open(os.path.join(PROJECT_LOCKS_DIR, f"{project}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+def download_repo_from_github(repo_url, branch="main", target_dir=None, progress_callback=None, force=False,
+                              checkpoint=None):
+    """Скачивание репозитория через GitHub API (под блокировкой проекта)"""
+    project = os.path.basename(os.path.normpath(target_dir)) if target_dir else None
+    with project_lock(project):
+        return _download_repo(repo_url, branch, target_dir, progress_callback, force, checkpoint)
+
+def _download_repo(repo_url, branch, target_dir, progress_callback, force, checkpoint):
+    temp_zip_path = None
+    checkpoint = checkpoint or (lambda stage=None: None)
+    project = os.path.basename(os.path.normpath(target_dir)) if target_dir else None
+    try:
+        checkpoint("download")
+        count_event("deploys", project=project)
+        logger.info(f"Скачивание {repo_url}, ветка {branch}")
         
-        parts = repo_url.replace("https://github.com/", "").replace(".git", "").split("/")
-        if len(parts) < 2:
-            raise Exception("Неверный формат URL")
+        username, repo_name = parse_github_repo(repo_url)
+        repo_key = f"{username}/{repo_name}".lower()
         
-        username, repo_name = parts[0], parts[1]
-        zip_url = f"https://github.com/{username}/{repo_name}/archive/refs/heads/{branch}.zip"
+        sha = resolve_branch_sha(username, repo_name, branch)
+        result = {"commit": sha, "skipped": False, "cached": False, "bytes": 0, "sync": None}
         
-        response = requests.get(zip_url, timeout=30)
-        if response.status_code != 200:
-            raise Exception(f"HTTP {response.status_code}")
+        if sha and target_dir and not force:
+            state = load_deploy_state(target_dir)
+            if (state.get("commit") == sha and state.get("repo") == repo_key and state.get("branch") == branch
+                    and os.path.isdir(target_dir) and os.path.exists(get_manifest_path(target_dir))):
+                logger.info(f"Ветка {branch} не изменилась ({sha[:7]}), обновление пропущено")
+                result["skipped"] = True
+                return result
         
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as temp_file:
-            temp_file.write(response.content)
-            temp_zip_path = temp_file.name
+        if sha:
+            zip_path, result["bytes"] = fetch_archive(username, repo_name, branch, sha, progress_callback)
+            result["cached"] = result["bytes"] == 0
+        else:
+            # Без SHA (API недоступен) скачиваем ветку напрямую, без кэша
+            zip_url = f"{GITHUB_URL}/{username}/{repo_name}/archive/refs/heads/{branch}.zip"
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as temp_file:
+                temp_zip_path = temp_file.name
+            download = stream_download(zip_url, temp_zip_path, progress_callback=progress_callback)
+            logger.info(f"Архив скачан: {download['bytes']} байт, sha256 {download['sha256']}")
+            zip_path, result["bytes"] = temp_zip_path, download['bytes']
+        count_event("download_bytes", result["bytes"], project)
+        
+        checkpoint("extract")
+        with extract_seconds.time(), zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            if target_dir:
+                sync = sync_archive_to_dir(zip_ref, target_dir, clean=(SYNC_MODE == 'full'), checkpoint=checkpoint)
+                result["sync"] = sync
+                logger.info(
+                    f"Синхронизация {target_dir}: +{sync['added']} ~{sync['changed']} "
+                    f"-{sync['removed']} ={sync['unchanged']}"
+                )
+        
+        if target_dir:
+            state = load_deploy_state(target_dir)
+            state.update({
+                "repo": repo_key,
+                "branch": branch,
+                "commit": sha,
+                "stats": result["sync"]["summary"]
+            })
+            save_deploy_state(target_dir, state)
         
-        with zipfile.ZipFile(temp_zip_path, 'r') as zip_ref:
-            with tempfile.TemporaryDirectory() as temp_extract_dir:
-                zip_ref.extractall(temp_extract_dir)
-                
-                extracted_folders = os.listdir(temp_extract_dir)
-                source_dir = os.path.join(temp_extract_dir, extracted_folders[0])
-                
-                if target_dir and not os.path.exists(target_dir):
-                    os.makedirs(target_dir)
-                
-                if target_dir:
-                    for item in os.listdir(target_dir):
-                        item_path = os.path.join(target_dir, item)
-                        try:
-                            if os.path.isdir(item_path):
-                                shutil.rmtree(item_path)
-                            else:
-                                os.remove(item_path)
-                        except:
-                            pass
-                    
-                    for item in os.listdir(source_dir):
-                        source_item = os.path.join(source_dir, item)
-                        target_item = os.path.join(target_dir, item)
-                        try:
-                            if os.path.isdir(source_item):
-                                shutil.copytree(source_item, target_item)
-                            else:
-                                shutil.copy2(source_item, target_item)
-                        except Exception as e:
-                            logger.warning(f"Не удалось скопировать {item}: {e}")
-        
-        os.unlink(temp_zip_path)
         logger.info(f"Репозиторий скачан в {target_dir}")
-        return True
+        return result
         
+    except JobCancelled:
+        # Отмена и остановка сервиса - не ошибки скачивания
+        raise
     except Exception as e:
-        system_stats["errors"] += 1
+        count_event("errors", project=project)
         logger.error(f"Ошибка скачивания: {str(e)}")
         raise e
+    finally:
+        if temp_zip_path and os.path.exists(temp_zip_path):
+            os.unlink(temp_zip_path)
 
-def load_config():
+# === ХРАНИЛИЩЕ ПРОЕКТОВ (SQLite) ===
+
+PROJECT_COLUMNS = ('repo_url', 'branch', 'path')
+db_local = threading.local()
+
+def get_db():
+    """Соединение с базой для текущего потока (WAL, ожидание блокировок)"""
+    conn = getattr(db_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_FILE, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=10000")
+        db_local.conn = conn
+    return conn
+
+@contextmanager
+def db_transaction():
+    """Транзакция с блокировкой записи с самого начала (BEGIN IMMEDIATE)"""
+    conn = get_db()
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-    except Exception as e:
-        logger.error(f"Ошибка загрузки конфига: {e}")
-    return {"projects": {}, "settings": {"webhook_secret": "", "auto_deploy": True}}
+        yield conn
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def init_db():
+    conn = get_db()
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS projects (
+            name TEXT PRIMARY KEY,
+            repo_url TEXT NOT NULL,
+            branch TEXT NOT NULL DEFAULT 'main',
+            path TEXT NOT NULL,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_projects_repo_url ON projects(repo_url);
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS webhook_deliveries (
+            id TEXT PRIMARY KEY,
+            received REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS counters (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS jobs (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            id TEXT NOT NULL UNIQUE,
+            kind TEXT NOT NULL,
+            project TEXT,
+            status TEXT NOT NULL,
+            coalesce_key TEXT,
+            not_before REAL NOT NULL DEFAULT 0,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, not_before);
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL,
+            data TEXT NOT NULL,
+            created REAL NOT NULL
+        );
+    """)
+    migrate_json_config()
 
-def save_config(config):
+def migrate_json_config():
+    """Однократный перенос проектов и настроек из config.json"""
+    if not os.path.exists(CONFIG_FILE):
+        return
     try:
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=2, ensure_ascii=False)
+        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        
+        with db_transaction() as conn:
+            for name, project in config.get('projects', {}).items():
+                _write_project(conn, name, project)
+            for key, value in config.get('settings', {}).items():
+                conn.execute(
+                    "INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False))
+                )
+        
+        os.replace(CONFIG_FILE, f"{CONFIG_FILE}.migrated")
+        logger.info(f"Конфиг перенесён в SQLite: {len(config.get('projects', {}))} проектов")
     except Exception as e:
-        logger.error(f"Ошибка сохранения конфига: {e}")
+        logger.error(f"Ошибка миграции конфига: {e}")
 
-def log_action(message, level="INFO"):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def _row_to_project(row):
+    project = json.loads(row["data"])
+    for column in PROJECT_COLUMNS:
+        project[column] = row[column]
+    return project
+
+def _write_project(conn, name, project):
+    data = {key: value for key, value in project.items() if key not in PROJECT_COLUMNS}
+    conn.execute(
+        """INSERT INTO projects (name, repo_url, branch, path, data, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+           ON CONFLICT(name) DO UPDATE SET repo_url = excluded.repo_url, branch = excluded.branch,
+           path = excluded.path, data = excluded.data, updated_at = excluded.updated_at""",
+        (name, project['repo_url'], project.get('branch') or 'main', project['path'],
+         json.dumps(data, ensure_ascii=False), time.time())
+    )
+    _bump_state_version(conn)
+
+def _bump_state_version(conn):
+    conn.execute(
+        "INSERT INTO counters (key, value) VALUES ('state_version', 1) "
+        "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+    )
+
+def get_state_version():
+    """Номер версии данных проектов: растёт при каждом изменении в любом процессе"""
+    row = get_db().execute("SELECT value FROM counters WHERE key = 'state_version'").fetchone()
+    return row[0] if row else 0
+
+def get_system_stats():
+    """Общие для всех процессов счётчики (накапливаются между перезапусками) и время запуска"""
+    started_at = get_setting("started_at")
+    return {
+        "start_time": datetime.fromtimestamp(started_at) if started_at else process_started,
+        "deploys": counter_store.value("deploys"),
+        "updates": counter_store.value("updates"),
+        "errors": counter_store.value("errors")
+    }
+
+def mark_service_started():
+    set_setting("started_at", time.time())
+
+def get_project_record(name):
+    row = get_db().execute("SELECT * FROM projects WHERE name = ?", (name,)).fetchone()
+    return _row_to_project(row) if row else None
+
+def list_project_records():
+    """Все проекты в порядке добавления"""
+    rows = get_db().execute("SELECT * FROM projects ORDER BY rowid").fetchall()
+    return {row["name"]: _row_to_project(row) for row in rows}
+
+def count_project_records():
+    return get_db().execute("SELECT COUNT(*) FROM projects").fetchone()[0]
+
+def find_projects_by_repo(repo_url):
+    """Проекты того же GitHub-репозитория (по индексу owner/repo)"""
+    projects = {}
+    for name in repo_index.lookup(repo_url):
+        project = get_project_record(name)
+        if project:
+            projects[name] = project
+    return projects
+
+def save_project_record(name, fields=None, increment=None, defaults=None, create=True):
+    """Атомарное изменение одной записи проекта: поля, счётчики и значения по умолчанию"""
+    with db_transaction() as conn:
+        row = conn.execute("SELECT * FROM projects WHERE name = ?", (name,)).fetchone()
+        if row is None and not create:
+            return None
+        
+        project = _row_to_project(row) if row else {}
+        for key, value in (defaults or {}).items():
+            project.setdefault(key, value)
+        project.update(fields or {})
+        for key, amount in (increment or {}).items():
+            project[key] = project.get(key, 0) + amount
+        
+        _write_project(conn, name, project)
+    repo_index.add(name, project['repo_url'])
+    aggregate_cache.invalidate()
+    return project
+
+def bulk_update_project_records(updates):
+    """Изменение нескольких проектов одной транзакцией: {имя: поля}"""
+    with db_transaction() as conn:
+        for name, fields in updates.items():
+            row = conn.execute("SELECT * FROM projects WHERE name = ?", (name,)).fetchone()
+            if row:
+                _write_project(conn, name, {**_row_to_project(row), **fields})
+    for name, fields in updates.items():
+        if 'repo_url' in fields:
+            repo_index.add(name, fields['repo_url'])
+    aggregate_cache.invalidate()
+
+def delete_project_record(name):
+    with db_transaction() as conn:
+        deleted = conn.execute("DELETE FROM projects WHERE name = ?", (name,)).rowcount > 0
+        if deleted:
+            _bump_state_version(conn)
+    repo_index.remove(name)
+    aggregate_cache.invalidate()
+    return deleted
+
+class RepoIndex:
+    """Индекс проектов по нормализованному owner/repo: точный поиск за O(1);
+    перестраивается, если проекты изменил другой процесс (по state_version)"""
+    
+    def __init__(self):
+        self.by_repo = {}
+        self.by_project = {}
+        self.version = None
+        self.lock = threading.Lock()
+    
+    def rebuild(self):
+        version = get_state_version()
+        rows = get_db().execute("SELECT name, repo_url FROM projects").fetchall()
+        with self.lock:
+            self.by_repo.clear()
+            self.by_project.clear()
+            self.version = version
+        for row in rows:
+            self.add(row["name"], row["repo_url"])
+    
+    def add(self, name, repo_url):
+        key = normalize_repo_key(repo_url)
+        with self.lock:
+            self._discard(name)
+            if key:
+                self.by_repo.setdefault(key, set()).add(name)
+                self.by_project[name] = key
+    
+    def remove(self, name):
+        with self.lock:
+            self._discard(name)
+    
+    def lookup(self, repo_url):
+        """Имена проектов репозитория (в любой форме URL)"""
+        if get_state_version() != self.version:
+            self.rebuild()
+        key = normalize_repo_key(repo_url)
+        with self.lock:
+            return sorted(self.by_repo.get(key, ())) if key else []
+    
+    def _discard(self, name):
+        key = self.by_project.pop(name, None)
+        if key:
+            names = self.by_repo.get(key, set())
+            names.discard(name)
+            if not names:
+                self.by_repo.pop(key, None)
+
+repo_index = RepoIndex()
+
+class AggregateCache:
+    """Кэш дорогих агрегатов по проектам.
+    Одновременные запросы одного ключа ждут одно вычисление (single-flight); после TTL значение
+    ещё AGGREGATE_CACHE_STALE_SECONDS отдаётся устаревшим, пока обновление идёт в фоне.
+    Изменение проектов (state_version, в т.ч. из другого процесса) делает значение недействительным сразу"""
+    
+    def __init__(self, ttl, stale_seconds):
+        self.ttl = ttl
+        self.stale_seconds = stale_seconds
+        self.entries = {}
+        self.inflight = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+    
+    def get(self, key, compute):
+        version = get_state_version()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry["version"] == version:
+                age = time.monotonic() - entry["at"]
+                if age < self.ttl:
+                    return entry["value"]
+                if age < self.ttl + self.stale_seconds:
+                    flight, leader = self._join((key, version))
+                    if leader:
+                        threading.Thread(
+                            target=self._compute, args=(key, version, compute, flight),
+                            daemon=True, name=f"cache-refresh-{key}"
+                        ).start()
+                    return entry["value"]
+            flight, leader = self._join((key, version))
+        
+        if leader:
+            self._compute(key, version, compute, flight)
+        else:
+            flight["done"].wait()
+        if flight["error"]:
+            raise flight["error"]
+        return flight["value"]
+    
+    def invalidate(self, key=None):
+        """Сброс значений (всех или одного ключа); уже идущие вычисления не сохранят результат"""
+        with self.lock:
+            self.generation += 1
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+    
+    def _join(self, flight_key):
+        flight = self.inflight.get(flight_key)
+        if flight:
+            return flight, False
+        flight = self.inflight[flight_key] = {
+            "done": threading.Event(), "value": None, "error": None, "generation": self.generation
+        }
+        return flight, True
+    
+    def _compute(self, key, version, compute, flight):
+        try:
+            flight["value"] = compute()
+            with self.lock:
+                if flight["generation"] == self.generation:
+                    self.entries[key] = {"value": flight["value"], "version": version, "at": time.monotonic()}
+        except Exception as e:
+            logger.error(f"❌ Ошибка вычисления {key}: {e}")
+            flight["error"] = e
+        finally:
+            with self.lock:
+                self.inflight.pop((key, version), None)
+            flight["done"].set()
+
+aggregate_cache = AggregateCache(AGGREGATE_CACHE_TTL, AGGREGATE_CACHE_STALE_SECONDS)
+
+def register_webhook_delivery(delivery_id):
+    """Запоминает ID доставки GitHub; False - такая доставка уже обработана"""
+    now = time.time()
+    with db_transaction() as conn:
+        conn.execute(
+            "DELETE FROM webhook_deliveries WHERE received < ?",
+            (now - WEBHOOK_DELIVERY_TTL_HOURS * 3600,)
+        )
+        return conn.execute(
+            "INSERT OR IGNORE INTO webhook_deliveries (id, received) VALUES (?, ?)",
+            (delivery_id, now)
+        ).rowcount > 0
+
+def forget_webhook_delivery(delivery_id):
+    """Отмена регистрации доставки, которую не удалось обработать: повторная доставка GitHub не будет дублем"""
+    with db_transaction() as conn:
+        conn.execute("DELETE FROM webhook_deliveries WHERE id = ?", (delivery_id,))
+
+def get_setting(key, default=None):
+    row = get_db().execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+    return json.loads(row["value"]) if row else default
+
+def set_setting(key, value):
+    with db_transaction() as conn:
+        conn.execute(
+            "INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(value, ensure_ascii=False))
+        )
+
+init_db()
+repo_index.rebuild()
+
+def log_action(message, level="INFO", project=None):
+    now = datetime.now()
+    timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
     log_message = f"[{timestamp}] [{level}] {message}"
     logger.info(log_message)
     
     try:
         with open(LOG_FILE, 'a', encoding='utf-8') as f:
             f.write(log_message + "\n")
+            log_size = f.tell()
+        if log_size >= LOG_MAX_MB * 1024 * 1024:
+            rotate_log()
     except Exception as e:
         logger.error(f"Ошибка записи в лог: {e}")
+    
+    if project:
+        try:
+            append_project_log(project, {
+                "ts": now.timestamp(),
+                "time": timestamp,
+                "level": level,
+                "project": project,
+                "message": message
+            })
+        except Exception as e:
+            logger.error(f"Ошибка записи в лог проекта {project}: {e}")
+    
+    event_bus.publish("log", {"time": timestamp, "level": level, "project": project, "message": message})
+
+# === ОБЩИЙ ЖУРНАЛ: РОТАЦИЯ И ЧТЕНИЕ С КОНЦА ===
+
+log_segment_cache = {"path": None, "data": None}
+log_segment_cache_lock = threading.Lock()
+LOG_SEGMENT_ID_BYTES = 256
+
+def _rotated_logs():
+    """Сжатые архивы журнала от новых к старым: [(метка, путь)]"""
+    log_dir, base_name = os.path.split(LOG_FILE)
+    rotated = []
+    for file_name in os.listdir(log_dir):
+        if file_name.startswith(base_name + '.') and file_name.endswith('.gz'):
+            stamp = file_name[len(base_name) + 1:-len('.gz')]
+            if stamp.isdigit():
+                rotated.append((stamp, os.path.join(log_dir, file_name)))
+    return sorted(rotated, key=lambda item: int(item[0]), reverse=True)
+
+def rotate_log():
+    """Сжатие текущего журнала в архив и удаление архивов сверх лимита"""
+    with log_rotate_lock, open(f"{LOG_FILE}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if not os.path.exists(LOG_FILE) or os.path.getsize(LOG_FILE) < LOG_MAX_MB * 1024 * 1024:
+            return
+        
+        rotating_path = f"{LOG_FILE}.rotating"
+        archive_path = f"{LOG_FILE}.{int(time.time() * 1000)}.gz"
+        os.replace(LOG_FILE, rotating_path)
+        with open(rotating_path, 'rb') as source, gzip.open(f"{archive_path}.tmp", 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.replace(f"{archive_path}.tmp", archive_path)
+        os.remove(rotating_path)
+        
+        expire_before = (time.time() - LOG_RETENTION_DAYS * 86400) * 1000
+        for index, (stamp, path) in enumerate(_rotated_logs()):
+            if index >= LOG_BACKUP_COUNT or int(stamp) < expire_before:
+                os.remove(path)
+        
+        logger.info(f"Журнал ротирован: {os.path.basename(archive_path)}")
+
+def _log_segments():
+    """Сегменты журнала от нового к старому: [(метка архива или None для текущего, путь)]"""
+    segments = [(None, LOG_FILE)] if os.path.exists(LOG_FILE) else []
+    return segments + _rotated_logs()
+
+def _segment_id(path):
+    """Идентификатор сегмента по хэшу его начала: архив побайтно совпадает с файлом, из которого
+    сжат, поэтому курсор текущего журнала остаётся действительным и после ротации"""
+    try:
+        with (gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')) as f:
+            head = f.read(LOG_SEGMENT_ID_BYTES)
+    except OSError:
+        return None
+    if not head:
+        return None
+    return hashlib.sha1(head.split(b'\n', 1)[0]).hexdigest()[:12]
+
+@contextmanager
+def _open_log_segment(path):
+    """Содержимое сегмента: текущий файл через mmap, архив - распакованный (с кэшем последнего)"""
+    if path.endswith('.gz'):
+        with log_segment_cache_lock:
+            if log_segment_cache["path"] != path:
+                with gzip.open(path, 'rb') as f:
+                    log_segment_cache["data"] = f.read()
+                log_segment_cache["path"] = path
+            data = log_segment_cache["data"]
+        yield data
+        return
+    
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield buffer
+
+def _tail_buffer(buffer, end, max_lines, max_bytes):
+    """Строки с конца буфера до позиции end: (строки от старых к новым, позиция первой строки)"""
+    lines = []
+    used = 0
+    begin = end
+    position = end
+    if position > 0 and buffer[position - 1:position] == b'\n':
+        position -= 1
+    
+    while position > 0 and len(lines) < max_lines:
+        newline = buffer.rfind(b'\n', 0, position)
+        line = buffer[newline + 1:position]
+        if lines and used + len(line) + 1 > max_bytes:
+            break
+        lines.append(line.decode('utf-8', errors='replace'))
+        used += len(line) + 1
+        begin = newline + 1
+        position = newline
+    
+    lines.reverse()
+    return lines, begin
+
+def read_log_page(max_lines=1000, cursor=None, max_bytes=50000):
+    """Страница журнала с конца; курсор '<сегмент>:<смещение>' ведёт к более старым записям.
+    Некорректный курсор - ValueError"""
+    segments = _log_segments()
+    start_index, end_offset = 0, None
+    if cursor:
+        segment_id, separator, offset = cursor.partition(':')
+        if not separator or not segment_id or not offset.lstrip('-').isdigit():
+            raise ValueError(f"Некорректный курсор: {cursor}")
+        # Сегмент ищется по хэшу начала; метка архива и "current" - для курсоров старого формата
+        for index, (stamp, path) in enumerate(segments):
+            if segment_id == stamp or (segment_id == "current" and stamp is None) or segment_id == _segment_id(path):
+                start_index = index
+                break
+        else:
+            return [], None
+        end_offset = int(offset) if int(offset) >= 0 else None
+    
+    page = []
+    for index in range(start_index, len(segments)):
+        path = segments[index][1]
+        remaining_lines = max_lines - len(page)
+        remaining_bytes = max_bytes - sum(len(line) + 1 for line in page)
+        if remaining_lines <= 0 or remaining_bytes <= 0:
+            return page, f"{_segment_id(path)}:-1"
+        
+        with _open_log_segment(path) as buffer:
+            end = len(buffer) if end_offset is None or end_offset > len(buffer) else end_offset
+            lines, begin = _tail_buffer(buffer, end, remaining_lines, remaining_bytes)
+        end_offset = None
+        page = lines + page
+        
+        if begin > 0:
+            return page, f"{_segment_id(path)}:{begin}"
+    
+    return page, None
+
+# === ЖУРНАЛЫ ПРОЕКТОВ ===
+
+def get_project_log_dir(project):
+    return os.path.join(PROJECT_LOGS_DIR, project)
+
+def _project_log_segments(project):
+    """Сегменты журнала проекта, от старых к новым: [(время начала, путь)]"""
+    log_dir = get_project_log_dir(project)
+    if not os.path.isdir(log_dir):
+        return []
+    segments = []
+    for file_name in os.listdir(log_dir):
+        if file_name.endswith('.jsonl'):
+            segments.append((int(file_name[:-len('.jsonl')]), os.path.join(log_dir, file_name)))
+    return sorted(segments)
+
+def append_project_log(project, record):
+    """Дозапись в текущий сегмент журнала проекта; новый сегмент - при превышении размера"""
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    with project_log_lock:
+        segments = _project_log_segments(project)
+        if not segments or os.path.getsize(segments[-1][1]) >= PROJECT_LOG_SEGMENT_KB * 1024:
+            os.makedirs(get_project_log_dir(project), exist_ok=True)
+            segment_start = int(record["ts"] * 1000)
+            if segments and segment_start <= segments[-1][0]:
+                segment_start = segments[-1][0] + 1
+            segment_path = os.path.join(get_project_log_dir(project), f"{segment_start:015d}.jsonl")
+            segments.append((segment_start, segment_path))
+            for _, old_path in segments[:-PROJECT_LOG_MAX_SEGMENTS]:
+                os.remove(old_path)
+        
+        with open(segments[-1][1], 'a', encoding='utf-8') as f:
+            f.write(line)
+
+def _read_segment(segment_path):
+    records = []
+    with open(segment_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+def read_project_logs(project, limit=100, since=None, until=None):
+    """Последние записи журнала проекта (с фильтром по времени), читаются только нужные сегменты"""
+    segments = _project_log_segments(project)
+    result = []
+    
+    # Обход от новых сегментов к старым; сегмент i покрывает [начало i, начало i+1)
+    for index in range(len(segments) - 1, -1, -1):
+        segment_start = segments[index][0] / 1000
+        segment_end = segments[index + 1][0] / 1000 if index + 1 < len(segments) else None
+        if until is not None and segment_start > until:
+            continue
+        if since is not None and segment_end is not None and segment_end < since:
+            break
+        
+        records = [
+            record for record in _read_segment(segments[index][1])
+            if (since is None or record["ts"] >= since) and (until is None or record["ts"] <= until)
+        ]
+        result = records + result
+        if limit and len(result) >= limit:
+            break
+    
+    return result[-limit:] if limit else result
+
+def parse_time_param(value):
+    """Время из параметра запроса: unix-время или 'YYYY-MM-DD HH:MM:SS' / ISO 8601"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def _walk_project_summary(project_path):
+    """Статистика проекта обходом дерева (для проектов без манифеста)"""
+    files = {}
+    for root, dirs, filenames in os.walk(project_path):
+        for file in filenames:
+            file_path = os.path.join(root, file)
+            try:
+                file_stat = os.stat(file_path)
+            except OSError:
+                continue
+            rel_path = os.path.relpath(file_path, project_path).replace(os.sep, '/')
+            files[rel_path] = {"size": file_stat.st_size, "mtime": file_stat.st_mtime}
+    return summarize_manifest(files)
 
 def get_project_info(project_path):
     """Получение информации о проекте"""
@@ -174,29 +1743,21 @@ def get_project_info(project_path):
     }
     
     try:
-        if os.path.exists(project_path):
-            total_size = 0
-            for root, dirs, files in os.walk(project_path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    if os.path.exists(file_path):
-                        file_size = os.path.getsize(file_path)
-                        total_size += file_size
-                        info["files_count"] += 1
-                        
-                        if file.endswith('.py'):
-                            info["python_files"] += 1
-                        elif file == 'requirements.txt':
-                            info["has_requirements"] = True
-                        
-                        # Последнее изменение
-                        mtime = os.path.getmtime(file_path)
-                        if not info["last_modified"] or mtime > info["last_modified"]:
-                            info["last_modified"] = datetime.fromtimestamp(mtime)
+        if project_path and os.path.isdir(project_path):
+            # Статистика берётся из манифеста, записанного при деплое
+            state = load_deploy_state(project_path)
+            summary = state.get("stats")
+            if summary is None:
+                summary = _walk_project_summary(project_path)
+                state["stats"] = summary
+                save_deploy_state(project_path, state)
             
-            info["size_mb"] = round(total_size / (1024 * 1024), 2)
-            if info["last_modified"]:
-                info["last_modified"] = info["last_modified"].strftime("%Y-%m-%d %H:%M:%S")
+            info["files_count"] = summary["files_count"]
+            info["python_files"] = summary["python_files"]
+            info["has_requirements"] = summary["has_requirements"]
+            info["size_mb"] = round(summary["total_size"] / (1024 * 1024), 2)
+            if summary["last_modified"]:
+                info["last_modified"] = datetime.fromtimestamp(summary["last_modified"]).strftime("%Y-%m-%d %H:%M:%S")
                 
     except Exception as e:
         logger.error(f"Ошибка получения информации о проекте: {e}")
@@ -211,30 +1772,1186 @@ def safe_message_send(message_text, parse_mode="HTML"):
         return message_text[:4000] + "..."
     return message_text
 
-def install_requirements(project_path, project_name):
-    """Установка зависимостей проекта"""
+# === ВИРТУАЛЬНЫЕ ОКРУЖЕНИЯ ПРОЕКТОВ ===
+
+VENV_BASE_DIR = os.path.join(VENVS_DIR, ".base")
+VENV_POOL_DIR = os.path.join(VENVS_DIR, ".pool")
+VENV_MARKER_FILE = ".deploy-venv"
+FICLONE = 0x40049409
+
+venv_lock = threading.Lock()
+venv_pool_lock = threading.Lock()
+venv_pool_state = {"running": False, "requested": False}
+reflink_supported = True
+
+def get_project_venv_dir(project_name):
+    return os.path.join(VENVS_DIR, project_name)
+
+def get_venv_python(venv_dir):
+    return os.path.join(venv_dir, "bin", "python")
+
+def _clone_file(src, dst):
+    """Копирование файла: copy-on-write (reflink), иначе жёсткая ссылка, иначе обычная копия"""
+    global reflink_supported
+    if reflink_supported:
+        try:
+            with open(src, 'rb') as source, open(dst, 'wb') as target:
+                fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+            shutil.copystat(src, dst)
+            return
+        except OSError:
+            reflink_supported = False
+            if os.path.exists(dst):
+                os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def _rewrite_venv_paths(venv_dir, old_prefix):
+    """Замена путей старого расположения в скриптах bin/ и pyvenv.cfg"""
+    old_bytes, new_bytes = old_prefix.encode(), venv_dir.encode()
+    candidates = [os.path.join(venv_dir, "pyvenv.cfg")]
+    bin_dir = os.path.join(venv_dir, "bin")
+    candidates += [os.path.join(bin_dir, name) for name in os.listdir(bin_dir)]
+    
+    for file_path in candidates:
+        if os.path.islink(file_path) or not os.path.isfile(file_path):
+            continue
+        with open(file_path, 'rb') as f:
+            content = f.read()
+        if old_bytes not in content:
+            continue
+        # Файл может быть жёсткой ссылкой на базовое окружение - пишем новый inode
+        file_mode = os.stat(file_path).st_mode
+        os.remove(file_path)
+        with open(file_path, 'wb') as f:
+            f.write(content.replace(old_bytes, new_bytes))
+        os.chmod(file_path, file_mode)
+
+def _mark_venv(venv_dir):
+    with open(os.path.join(venv_dir, VENV_MARKER_FILE), 'w') as f:
+        f.write(uuid.uuid4().hex)
+
+def ensure_base_venv():
+    """Базовое окружение, из которого клонируются venv проектов (создаётся один раз)"""
+    with venv_lock:
+        if os.path.exists(get_venv_python(VENV_BASE_DIR)):
+            return VENV_BASE_DIR
+        
+        temp_dir = f"{VENV_BASE_DIR}.tmp-{uuid.uuid4().hex[:8]}"
+        logger.info("Создание базового виртуального окружения")
+        subprocess.run([sys.executable, '-m', 'venv', temp_dir], check=True, capture_output=True, timeout=300)
+        os.rename(temp_dir, VENV_BASE_DIR)
+        _rewrite_venv_paths(VENV_BASE_DIR, temp_dir)
+        return VENV_BASE_DIR
+
+def clone_venv(dest_dir):
+    """Быстрое создание venv клонированием базового окружения"""
+    base_dir = ensure_base_venv()
+    temp_dir = f"{dest_dir}.tmp-{uuid.uuid4().hex[:8]}"
+    try:
+        shutil.copytree(base_dir, temp_dir, symlinks=True, copy_function=_clone_file)
+        _rewrite_venv_paths(temp_dir, base_dir)
+        os.rename(temp_dir, dest_dir)
+        _rewrite_venv_paths(dest_dir, temp_dir)
+        _mark_venv(dest_dir)
+    except Exception:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+    return dest_dir
+
+def refill_venv_pool():
+    """Пополнение пула заранее созданных окружений. В процессе работает одно пополнение:
+    повторные вызовы лишь просят его пройти ещё раз (пул мог опустеть, пока оно шло)"""
+    with venv_pool_lock:
+        venv_pool_state["requested"] = True
+        if venv_pool_state["running"]:
+            return
+        venv_pool_state["running"] = True
+    
+    try:
+        while True:
+            with venv_pool_lock:
+                if not venv_pool_state["requested"]:
+                    return
+                venv_pool_state["requested"] = False
+            _fill_venv_pool()
+    except Exception as e:
+        logger.error(f"Ошибка пополнения пула окружений: {e}")
+    finally:
+        with venv_pool_lock:
+            venv_pool_state["running"] = False
+
+def _fill_venv_pool():
+    """Клонирование окружений до VENV_POOL_SIZE под flock: другие процессы не переполнят пул,
+    а временные каталоги в пуле при удержании блокировки - остатки прерванных клонирований"""
+    os.makedirs(VENV_POOL_DIR, exist_ok=True)
+    with open(f"{VENV_POOL_DIR}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        for name in os.listdir(VENV_POOL_DIR):
+            if '.tmp-' in name:
+                shutil.rmtree(os.path.join(VENV_POOL_DIR, name), ignore_errors=True)
+        while len(os.listdir(VENV_POOL_DIR)) < VENV_POOL_SIZE:
+            clone_venv(os.path.join(VENV_POOL_DIR, uuid.uuid4().hex[:12]))
+
+def cleanup_stale_venv_temps():
+    """Удаление временных каталогов окружений, оставшихся после падения или остановки во время клонирования"""
+    for directory in (VENVS_DIR, VENV_POOL_DIR):
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            if '.tmp-' in name:
+                shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+                logger.info(f"Удалён незавершённый каталог окружения: {name}")
+
+def _take_pooled_venv(dest_dir):
+    """Перемещение готового окружения из пула (None, если пул пуст)"""
+    with venv_lock:
+        if not os.path.isdir(VENV_POOL_DIR):
+            return None
+        for name in os.listdir(VENV_POOL_DIR):
+            pooled_dir = os.path.join(VENV_POOL_DIR, name)
+            if '.tmp-' in name or not os.path.exists(get_venv_python(pooled_dir)):
+                continue
+            os.rename(pooled_dir, dest_dir)
+            _rewrite_venv_paths(dest_dir, pooled_dir)
+            _mark_venv(dest_dir)
+            return dest_dir
+    return None
+
+def ensure_project_venv(project_name):
+    """Интерпретатор venv проекта; окружение берётся из пула или клонируется"""
+    venv_dir = get_project_venv_dir(project_name)
+    if os.path.exists(get_venv_python(venv_dir)):
+        return get_venv_python(venv_dir)
+    
+    if os.path.exists(venv_dir):
+        shutil.rmtree(venv_dir)
+    
+    if _take_pooled_venv(venv_dir):
+        logger.info(f"Окружение {project_name} взято из пула")
+    else:
+        clone_venv(venv_dir)
+        logger.info(f"Окружение {project_name} клонировано из базового")
+    
+    if VENV_POOL_SIZE > 0:
+        threading.Thread(target=refill_venv_pool, daemon=True).start()
+    return get_venv_python(venv_dir)
+
+def get_pip_command(project_name):
+    """Команда pip: venv проекта или интерпретатор менеджера"""
+    if PROJECT_VENVS:
+        return [ensure_project_venv(project_name), '-m', 'pip']
+    return ['pip']
+
+def _venv_identity(project_name):
+    if not PROJECT_VENVS:
+        return f"pip: {shutil.which('pip')}"
+    try:
+        with open(os.path.join(get_project_venv_dir(project_name), VENV_MARKER_FILE), 'r') as f:
+            return f"venv: {f.read().strip()}"
+    except OSError:
+        return "venv: missing"
+
+REQUIREMENTS_INCLUDE_OPTIONS = ('-r', '--requirement', '-c', '--constraint')
+EXTRA_LOCK_FILES = ('constraints.txt', 'requirements.lock', 'requirements-lock.txt')
+
+def _normalize_requirements_file(file_path, seen):
+    """Нормализованные строки файла зависимостей с рекурсивным разбором -r/-c"""
+    if file_path in seen or not os.path.isfile(file_path):
+        return []
+    seen.add(file_path)
+    
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+        content = f.read().replace('\\\n', ' ')
+    
+    lines = [f"# {os.path.basename(file_path)}"]
+    for raw_line in content.splitlines():
+        line = raw_line.split(' #', 1)[0].strip()
+        if not line or line.startswith('#'):
+            continue
+        line = ' '.join(line.split())
+        # Имена пакетов регистронезависимы, а путь подключаемого файла - нет: он берётся из исходной строки
+        lines.append(line.lower())
+        
+        for option in REQUIREMENTS_INCLUDE_OPTIONS:
+            if line.lower().startswith(option + ' ') or line.lower().startswith(option + '='):
+                included = line[len(option) + 1:].strip()
+                lines.extend(_normalize_requirements_file(
+                    os.path.join(os.path.dirname(file_path), included), seen
+                ))
+    return lines
+
+def requirements_fingerprint(project_path, project_name=None):
+    """Хэш нормализованных requirements.txt, подключаемых файлов и lock-файлов"""
+    seen = set()
+    lines = _normalize_requirements_file(os.path.join(project_path, 'requirements.txt'), seen)
+    for lock_file in EXTRA_LOCK_FILES:
+        lines.extend(_normalize_requirements_file(os.path.join(project_path, lock_file), seen))
+    lines.append(f"# {_venv_identity(project_name or os.path.basename(os.path.normpath(project_path)))}")
+    return hashlib.sha256('\n'.join(lines).encode('utf-8')).hexdigest()
+
+# === СКЛАД WHEEL-ПАКЕТОВ ===
+
+class PipInterrupted(Exception):
+    """pip остановлен по таймауту или по запросу отмены"""
+
+def _run_pip(command, deadline, should_stop=None, on_output=None):
+    """Запуск pip с общим дедлайном и проверкой отмены; возвращает (код, stdout, stderr)"""
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1)
+    output = {"stdout": [], "stderr": []}
+    
+    def pump(stream, name):
+        # Построчное чтение, чтобы вывод pip был виден по ходу установки
+        for line in stream:
+            output[name].append(line)
+            if on_output:
+                on_output(line.rstrip('\n'))
+    
+    readers = [
+        threading.Thread(target=pump, args=(process.stdout, "stdout"), daemon=True),
+        threading.Thread(target=pump, args=(process.stderr, "stderr"), daemon=True)
+    ]
+    for reader in readers:
+        reader.start()
+    
+    try:
+        while True:
+            try:
+                process.wait(timeout=1)
+                break
+            except subprocess.TimeoutExpired:
+                if time.monotonic() > deadline:
+                    process.kill()
+                    process.wait()
+                    raise PipInterrupted("Таймаут установки зависимостей")
+                if should_stop and should_stop():
+                    process.kill()
+                    process.wait()
+                    raise PipInterrupted("Установка зависимостей прервана")
+    finally:
+        for reader in readers:
+            reader.join(5)
+    
+    return process.returncode, ''.join(output["stdout"]), ''.join(output["stderr"])
+
+class WheelhouseLock:
+    """Межпроцессная блокировка склада: установки читают совместно, очистка - эксклюзивно"""
+    
+    def __init__(self, exclusive=False, blocking=True):
+        self.mode = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        if not blocking:
+            self.mode |= fcntl.LOCK_NB
+        self.file = None
+    
+    def __enter__(self):
+        self.file = open(os.path.join(WHEELHOUSE_DIR, ".lock"), 'a')
+        try:
+            fcntl.flock(self.file, self.mode)
+        except OSError:
+            self.file.close()
+            raise
+        return self
+    
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+def _index_args():
+    return ['--index-url', WHEELHOUSE_INDEX_URL] if WHEELHOUSE_INDEX_URL else []
+
+def _touch_used_wheels(report_path):
+    """Отметка использованных wheel-файлов по отчёту pip (для вытеснения неиспользуемых)"""
+    try:
+        with open(report_path, 'r', encoding='utf-8') as f:
+            report = json.load(f)
+    except Exception:
+        return
+    for item in report.get("install", []):
+        url = item.get("download_info", {}).get("url", "")
+        if url.startswith("file://"):
+            wheel_path = requests.utils.unquote(url[len("file://"):])
+            if os.path.dirname(wheel_path) == WHEELHOUSE_DIR and os.path.exists(wheel_path):
+                os.utime(wheel_path)
+
+def build_wheels(pip_command, req_file, deadline, should_stop=None, on_output=None):
+    """Сборка/скачивание недостающих wheel во временную папку и атомарный перенос на склад"""
+    with tempfile.TemporaryDirectory(dir=WHEELHOUSE_DIR, prefix=".build-") as build_dir:
+        returncode, stdout, stderr = _run_pip(
+            pip_command + ['wheel', '-r', req_file, '-w', build_dir, '--find-links', WHEELHOUSE_DIR] + _index_args(),
+            deadline, should_stop, on_output
+        )
+        if returncode != 0:
+            return False, stderr
+        
+        with WheelhouseLock():
+            for name in os.listdir(build_dir):
+                if name.endswith('.whl') and not os.path.exists(os.path.join(WHEELHOUSE_DIR, name)):
+                    os.replace(os.path.join(build_dir, name), os.path.join(WHEELHOUSE_DIR, name))
+        return True, stdout
+
+def install_from_wheelhouse(pip_command, req_file, deadline, should_stop=None, on_output=None):
+    """Офлайн-установка только из склада; (код, stdout, stderr)"""
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as report_file:
+        report_path = report_file.name
+    try:
+        with WheelhouseLock():
+            result = _run_pip(
+                pip_command + ['install', '--no-index', '--find-links', WHEELHOUSE_DIR,
+                               '-r', req_file, '--report', report_path],
+                deadline, should_stop, on_output
+            )
+            if result[0] == 0:
+                _touch_used_wheels(report_path)
+        return result
+    finally:
+        os.unlink(report_path)
+
+def evict_wheelhouse(max_bytes=None, max_age_days=None):
+    """Удаление давно неиспользуемых wheel и LRU-вытеснение при превышении лимита размера"""
+    max_bytes = WHEELHOUSE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+    max_age_days = WHEELHOUSE_MAX_AGE_DAYS if max_age_days is None else max_age_days
+    try:
+        with WheelhouseLock(exclusive=True, blocking=False):
+            wheels = []
+            for entry in os.scandir(WHEELHOUSE_DIR):
+                if entry.is_file() and entry.name.endswith('.whl'):
+                    entry_stat = entry.stat()
+                    wheels.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+            
+            expire_before = time.time() - max_age_days * 86400
+            total_size = sum(size for _, size, _ in wheels)
+            for mtime, size, path in sorted(wheels):
+                if mtime >= expire_before and total_size <= max_bytes:
+                    break
+                os.remove(path)
+                total_size -= size
+                logger.info(f"Wheel удалён со склада: {os.path.basename(path)}")
+    except BlockingIOError:
+        logger.info("Склад wheel занят установкой, очистка отложена")
+
+def install_requirements(project_path, project_name, timeout=300, should_stop=None, force=False, on_output=None):
+    """Установка зависимостей проекта (пропускается, если requirements не менялись; под блокировкой проекта)"""
+    # Ключ блокировки - каталог проекта, как в download_repo_from_github
+    with project_lock(os.path.basename(os.path.normpath(project_path))):
+        return _install_requirements(project_path, project_name, timeout, should_stop, force, on_output)
+
+def _install_requirements(project_path, project_name, timeout, should_stop, force, on_output):
     req_file = os.path.join(project_path, 'requirements.txt')
     if os.path.exists(req_file):
-        log_action(f"Установка зависимостей для {project_name}")
         try:
-            result = subprocess.run(
-                ['pip', 'install', '-r', req_file],
-                capture_output=True,
-                text=True,
-                timeout=300  # 5 минут таймаут
-            )
-            if result.returncode == 0:
-                log_action(f"Зависимости установлены для {project_name}")
+            pip_command = get_pip_command(project_name)
+        except Exception as e:
+            log_action(f"Ошибка создания окружения для {project_name}: {e}", "ERROR", project=project_name)
+            return False, f"Ошибка создания окружения: {e}"
+        
+        fingerprint = requirements_fingerprint(project_path, project_name)
+        state = load_deploy_state(project_path)
+        if not force and state.get("requirements_hash") == fingerprint:
+            log_action(f"Зависимости {project_name} не изменились, установка пропущена", project=project_name)
+            return True, "Зависимости не изменились, установка пропущена"
+        
+        log_action(f"Установка зависимостей для {project_name}", project=project_name)
+        started = time.monotonic()
+        deadline = started + timeout
+        outcome = "error"
+        try:
+            if WHEELHOUSE_ENABLED:
+                # Сначала офлайн со склада; недостающие wheel собираются один раз на все проекты
+                returncode, stdout, stderr = install_from_wheelhouse(pip_command, req_file, deadline, should_stop, on_output)
+                if returncode != 0:
+                    built, build_output = build_wheels(pip_command, req_file, deadline, should_stop, on_output)
+                    if built:
+                        returncode, stdout, stderr = install_from_wheelhouse(
+                            pip_command, req_file, deadline, should_stop, on_output
+                        )
+                    if returncode != 0:
+                        # Путь/VCS/editable-зависимости офлайн не ставятся (сборка из исходников требует
+                        # setuptools из индекса) - обычная установка, склад используется как доп. источник
+                        log_action(
+                            f"Склад wheel не покрывает зависимости {project_name}, установка из индекса",
+                            "WARNING", project=project_name
+                        )
+                        returncode, stdout, stderr = _run_pip(
+                            pip_command + ['install', '-r', req_file, '--find-links', WHEELHOUSE_DIR] + _index_args(),
+                            deadline, should_stop, on_output
+                        )
+            else:
+                returncode, stdout, stderr = _run_pip(
+                    pip_command + ['install', '-r', req_file], deadline, should_stop, on_output
+                )
+            
+            if returncode == 0:
+                outcome = "ok"
+                state = load_deploy_state(project_path)
+                state["requirements_hash"] = fingerprint
+                save_deploy_state(project_path, state)
+                if WHEELHOUSE_ENABLED:
+                    evict_wheelhouse()
+                log_action(f"Зависимости установлены для {project_name}", project=project_name)
                 return True, "Зависимости установлены успешно"
             else:
-                log_action(f"Ошибка установки зависимостей для {project_name}: {result.stderr}", "ERROR")
-                return False, result.stderr
-        except subprocess.TimeoutExpired:
-            return False, "Таймаут установки зависимостей"
+                log_action(f"Ошибка установки зависимостей для {project_name}: {stderr}", "ERROR", project=project_name)
+                return False, stderr
         except Exception as e:
+            outcome = "interrupted" if isinstance(e, PipInterrupted) else "error"
             return False, str(e)
+        finally:
+            pip_install_seconds.observe(time.monotonic() - started, outcome)
     return True, "requirements.txt не найден"
 
+# === ОЧЕРЕДЬ ДЕПЛОЕВ ===
+
+class JobCancelled(Exception):
+    """Задача отменена или превысила таймаут этапа"""
+
+class DeployJob:
+    """Задача фоновой очереди деплоев"""
+    
+    def __init__(self, kind, params, project=None, job_id=None, on_change=None, not_before=0.0, coalesce_key=None):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.project = project
+        self.params = params
+        self.not_before = not_before
+        self.coalesce_key = coalesce_key
+        self.first_queued = time.time()
+        self.status = "queued"
+        self.stage = None
+        self.stage_started = None
+        self.progress = {}
+        self.created = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.interrupted = False
+        self.on_change = on_change
+        self.last_progress_event = 0.0
+    
+    def set_stage(self, stage):
+        self.record_stage_time()
+        self.stage = stage
+        self.stage_started = time.monotonic()
+        self.progress = {}
+        if self.on_change:
+            self.on_change(self)
+    
+    def checkpoint(self, stage=None):
+        """Смена этапа и проверка отмены/таймаута этапа"""
+        if stage and stage != self.stage:
+            self.set_stage(stage)
+        if self.cancel_event.is_set():
+            raise JobCancelled("Задача отменена")
+        timeout = STAGE_TIMEOUTS.get(self.stage)
+        if timeout and self.stage_started and time.monotonic() - self.stage_started > timeout:
+            raise JobCancelled(f"Превышен таймаут этапа {self.stage} ({timeout} с)")
+    
+    def record_stage_time(self):
+        """Время завершившегося этапа - в счётчики (мс, всего и по проекту)"""
+        if self.stage and self.stage_started:
+            elapsed_ms = int((time.monotonic() - self.stage_started) * 1000)
+            count_event(f"stage_ms:{self.stage}", elapsed_ms, self.project)
+            self.stage_started = None
+    
+    def stage_time_left(self):
+        timeout = STAGE_TIMEOUTS.get(self.stage, 300)
+        return max(1, timeout - (time.monotonic() - (self.stage_started or time.monotonic())))
+    
+    def report_download(self, downloaded, total):
+        self.progress = {"bytes": downloaded, "total": total}
+        now = time.monotonic()
+        if now - self.last_progress_event >= DOWNLOAD_EVENT_INTERVAL or downloaded == total:
+            self.last_progress_event = now
+            event_bus.publish("progress", {"id": self.id, "project": self.project, "stage": self.stage, **self.progress})
+        self.checkpoint()
+    
+    def report_output(self, line):
+        """Строка вывода pip - в поток событий"""
+        if line.strip():
+            event_bus.publish("output", {"id": self.id, "project": self.project, "line": line})
+    
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "project": self.project,
+            "params": self.params,
+            "not_before": self.not_before,
+            "coalesce_key": self.coalesce_key,
+            "first_queued": self.first_queued,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "result": self.result,
+            "error": self.error
+        }
+    
+    @classmethod
+    def from_dict(cls, data, on_change=None):
+        job = cls(
+            data["kind"], data.get("params", {}), data.get("project"), data["id"], on_change,
+            data.get("not_before") or 0.0, data.get("coalesce_key")
+        )
+        for key in ("status", "stage", "created", "started", "finished", "result", "error"):
+            setattr(job, key, data.get(key))
+        job.first_queued = data.get("first_queued") or job.first_queued
+        return job
+
+class JobQueue:
+    """Очередь деплоев в SQLite: ставить задачи и читать статус может любой процесс,
+    выполняют их воркеры процесса бота"""
+    
+    def __init__(self, jobs_file, workers):
+        self.jobs_file = jobs_file
+        self.workers = workers
+        self.handlers = {}
+        self.running = {}
+        self.condition = threading.Condition()
+        self.threads = []
+        self.accepting = True
+        self.stopping = False
+    
+    def handler(self, kind):
+        """Декоратор регистрации обработчика задач указанного типа"""
+        def decorator(func):
+            self.handlers[kind] = func
+            return func
+        return decorator
+    
+    def load(self):
+        """Перенос задач из старого jobs.json и возврат в очередь задач, прерванных падением процесса"""
+        if os.path.exists(self.jobs_file):
+            try:
+                with open(self.jobs_file, 'r', encoding='utf-8') as f:
+                    saved_jobs = json.load(f)
+                with db_transaction() as conn:
+                    for data in saved_jobs:
+                        self._save(conn, DeployJob.from_dict(data), insert_only=True)
+                os.replace(self.jobs_file, f"{self.jobs_file}.migrated")
+            except Exception as e:
+                logger.error(f"Ошибка переноса очереди задач из {self.jobs_file}: {e}")
+        
+        with db_transaction() as conn:
+            restored = conn.execute(
+                "UPDATE jobs SET status = 'queued', cancel_requested = 0 WHERE status IN ('queued', 'running')"
+            ).rowcount
+        
+        if restored:
+            logger.info(f"Восстановлено задач в очереди: {restored}")
+    
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"deploy-worker-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        threading.Thread(target=self._watch_cancellations, name="deploy-cancel-watch", daemon=True).start()
+        logger.info(f"Очередь деплоев запущена: {self.workers} воркеров")
+    
+    def submit(self, kind, params, project=None, delay=0, coalesce_key=None):
+        """Постановка задачи; с coalesce_key ещё не начатая задача с тем же ключом
+        получает новые параметры и сдвигает запуск на delay секунд вместо создания новой
+        (но не дальше COALESCE_MAX_DELAYS окон от первого запроса).
+        Если задача с этим ключом уже выполняется, новая (не больше одной в очереди) ждёт её завершения:
+        выполняемая могла скачать коммит до пуша, а задачи одного проекта не выполняются параллельно"""
+        if kind not in self.handlers:
+            raise Exception(f"Неизвестный тип задачи: {kind}")
+        if not self.accepting:
+            raise Exception("Очередь деплоев остановлена")
+        
+        not_before = time.time() + delay if delay else 0.0
+        with db_transaction() as conn:
+            row = None
+            if coalesce_key:
+                row = conn.execute(
+                    "SELECT data FROM jobs WHERE coalesce_key = ? AND status = 'queued' ORDER BY seq LIMIT 1",
+                    (coalesce_key,)
+                ).fetchone()
+            
+            running = None
+            if row:
+                job = DeployJob.from_dict(json.loads(row["data"]))
+                job.params = params
+                job.not_before = min(not_before, job.first_queued + COALESCE_MAX_DELAYS * delay)
+                coalesced = True
+            else:
+                job = DeployJob(kind, params, project, not_before=not_before, coalesce_key=coalesce_key)
+                coalesced = False
+                if coalesce_key:
+                    running = conn.execute(
+                        "SELECT id FROM jobs WHERE coalesce_key = ? AND status = 'running' LIMIT 1", (coalesce_key,)
+                    ).fetchone()
+            self._save(conn, job)
+        
+        with self.condition:
+            self.condition.notify()
+        self._publish(job)
+        
+        if coalesced:
+            log_action(f"Задача {job.id} ({kind}) объединена с новым запросом: {project}", project=project)
+        elif running:
+            log_action(
+                f"Задача {job.id} ({kind}) поставлена в очередь после выполняемой {running['id']}: {project}",
+                project=project
+            )
+        else:
+            log_action(f"Задача {job.id} ({kind}) поставлена в очередь: {project}", project=project)
+        return job
+    
+    def status_counts(self):
+        counts = {"queued": 0, "running": 0}
+        for row in get_db().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall():
+            counts[row[0]] = row[1]
+        return counts
+    
+    def get(self, job_id):
+        row = get_db().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row["data"]) if row else None
+    
+    def list(self, limit=50):
+        rows = get_db().execute("SELECT data FROM jobs ORDER BY seq DESC LIMIT ?", (limit,)).fetchall()
+        return [json.loads(row["data"]) for row in rows]
+    
+    def cancel(self, job_id):
+        """Отмена задачи: из очереди удаляется сразу, выполняемая прерывается на ближайшем этапе"""
+        with db_transaction() as conn:
+            row = conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if not row:
+                return False
+            job = DeployJob.from_dict(json.loads(row["data"]))
+            if job.status == "queued":
+                job.status = "cancelled"
+                job.finished = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                self._save(conn, job)
+            elif job.status == "running":
+                # Выполняющий процесс заметит флаг в _watch_cancellations
+                conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+            else:
+                return False
+        
+        with self.condition:
+            local_job = self.running.get(job_id)
+        if local_job:
+            local_job.cancel_event.set()
+        
+        self._publish(job)
+        log_action(f"Задача {job_id} отменена", project=job.project)
+        return True
+    
+    def cancel_project(self, project):
+        """Отмена всех ещё не завершённых задач проекта; возвращает ID отменённых"""
+        rows = get_db().execute(
+            "SELECT id FROM jobs WHERE project = ? AND status IN ('queued', 'running')", (project,)
+        ).fetchall()
+        return [row["id"] for row in rows if self.cancel(row["id"])]
+    
+    def wait_project_idle(self, project, timeout):
+        """Ожидание, пока у проекта не останется выполняемых задач (в любом процессе); False - таймаут"""
+        deadline = time.monotonic() + timeout
+        while get_db().execute(
+            "SELECT 1 FROM jobs WHERE project = ? AND status = 'running' LIMIT 1", (project,)
+        ).fetchone():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.2)
+        return True
+    
+    def shutdown(self, timeout=None):
+        """Плавная остановка: новые задачи не принимаются, выполняемые дорабатывают"""
+        timeout = JOB_DRAIN_TIMEOUT if timeout is None else timeout
+        with self.condition:
+            self.accepting = False
+            self.stopping = True
+            self.condition.notify_all()
+        
+        deadline = time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        
+        with self.condition:
+            running = list(self.running.values())
+        for job in running:
+            job.interrupted = True
+            job.cancel_event.set()
+        for thread in self.threads:
+            thread.join(5)
+        
+        logger.info(f"Очередь деплоев остановлена, в очереди осталось: {self.status_counts()['queued']}")
+    
+    def _claim(self):
+        """Захват первой готовой задачи; иначе (None, сколько ждать)"""
+        now = time.time()
+        with db_transaction() as conn:
+            # Задачи проекта, у которого уже идёт задача, ждут её завершения: два деплоя одного проекта
+            # писали бы в один каталог и одно окружение
+            ready = (
+                "status = 'queued' AND (project IS NULL OR project NOT IN "
+                "(SELECT project FROM jobs WHERE status = 'running' AND project IS NOT NULL))"
+            )
+            row = conn.execute(
+                f"SELECT data FROM jobs WHERE {ready} AND not_before <= ? ORDER BY seq LIMIT 1", (now,)
+            ).fetchone()
+            if not row:
+                next_start = conn.execute(
+                    f"SELECT MIN(not_before) FROM jobs WHERE {ready} AND not_before > ?", (now,)
+                ).fetchone()[0]
+                wait = JOB_POLL_INTERVAL if next_start is None else max(0.0, min(JOB_POLL_INTERVAL, next_start - now))
+                return None, wait
+            
+            job = DeployJob.from_dict(json.loads(row["data"]), on_change=self._on_job_change)
+            job.status = "running"
+            job.started = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self._save(conn, job)
+        with self.condition:
+            self.running[job.id] = job
+        return job, None
+    
+    def _worker(self):
+        while True:
+            with self.condition:
+                if self.stopping:
+                    return
+            
+            try:
+                job, wait = self._claim()
+            except Exception as e:
+                logger.error(f"Ошибка выборки задачи из очереди: {e}")
+                job, wait = None, JOB_POLL_INTERVAL
+            
+            if not job:
+                with self.condition:
+                    if not self.stopping:
+                        self.condition.wait(wait)
+                continue
+            
+            self._publish(job)
+            started = time.monotonic()
+            try:
+                job.result = self.handlers[job.kind](job)
+                job.status = "succeeded"
+            except JobCancelled as e:
+                job.status = "cancelled"
+                job.error = str(e)
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+            job.record_stage_time()
+            
+            if job.status == "cancelled" and job.interrupted:
+                # Прервана остановкой сервиса - будет выполнена после перезапуска
+                job.status = "queued"
+                job.stage = None
+            else:
+                job.finished = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            
+            with self.condition:
+                self.running.pop(job.id, None)
+            with db_transaction() as conn:
+                self._save(conn, job)
+                conn.execute("UPDATE jobs SET cancel_requested = 0 WHERE id = ?", (job.id,))
+                self._trim_history(conn)
+            with self.condition:
+                # Задачи этого проекта, ждавшие завершения, можно брать в работу
+                self.condition.notify_all()
+            self._publish(job)
+            job_seconds.observe(time.monotonic() - started, job.kind, job.status)
+            
+            log_action(f"Задача {job.id} ({job.kind}) завершена: {job.status}", project=job.project)
+    
+    def _watch_cancellations(self):
+        """Отмены, запрошенные другими процессами, для задач этого процесса"""
+        while not self.stopping:
+            time.sleep(JOB_POLL_INTERVAL)
+            with self.condition:
+                ids = list(self.running)
+            if not ids:
+                continue
+            try:
+                rows = get_db().execute(
+                    f"SELECT id FROM jobs WHERE cancel_requested = 1 AND id IN ({','.join('?' * len(ids))})", ids
+                ).fetchall()
+                for row in rows:
+                    job = self.running.get(row["id"])
+                    if job:
+                        job.cancel_event.set()
+            except Exception as e:
+                logger.error(f"Ошибка проверки отмены задач: {e}")
+    
+    def _on_job_change(self, job):
+        with db_transaction() as conn:
+            self._save(conn, job)
+        self._publish(job)
+    
+    def _save(self, conn, job, insert_only=False):
+        """Запись задачи (вызывается внутри транзакции)"""
+        values = (job.id, job.kind, job.project, job.status, job.coalesce_key, job.not_before,
+                  json.dumps(job.to_dict(), ensure_ascii=False))
+        if insert_only:
+            conn.execute(
+                """INSERT OR IGNORE INTO jobs (id, kind, project, status, coalesce_key, not_before, data)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""", values
+            )
+            return
+        conn.execute(
+            """INSERT INTO jobs (id, kind, project, status, coalesce_key, not_before, data) VALUES (?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT(id) DO UPDATE SET status = excluded.status, coalesce_key = excluded.coalesce_key,
+               not_before = excluded.not_before, data = excluded.data""",
+            values
+        )
+    
+    def _trim_history(self, conn):
+        conn.execute(
+            """DELETE FROM jobs WHERE status NOT IN ('queued', 'running') AND seq NOT IN (
+                   SELECT seq FROM jobs WHERE status NOT IN ('queued', 'running') ORDER BY seq DESC LIMIT ?)""",
+            (JOBS_HISTORY_LIMIT,)
+        )
+    
+    def _publish(self, job):
+        """Состояние задачи в поток событий (параметры не передаются)"""
+        data = job.to_dict()
+        data.pop("params", None)
+        event_bus.publish("job", data)
+
+job_queue = JobQueue(JOBS_FILE, JOB_WORKERS)
+
+def run_job_pipeline(job, project_name, repo_url, branch, project_path):
+    """Этапы деплоя в задаче: скачивание, распаковка, установка зависимостей"""
+    force = bool(job.params.get("force"))
+    download = download_repo_from_github(
+        repo_url, branch, project_path,
+        progress_callback=job.report_download,
+        checkpoint=job.checkpoint,
+        force=force
+    )
+    
+    job.checkpoint("install")
+    success, deps_msg = install_requirements(
+        project_path, project_name,
+        timeout=job.stage_time_left(),
+        should_stop=job.cancel_event.is_set,
+        force=force,
+        on_output=job.report_output
+    )
+    job.checkpoint()
+    return download, success, deps_msg
+
+@job_queue.handler("deploy")
+def run_deploy_job(job):
+    """Задача деплоя нового или существующего проекта"""
+    project_name = job.params["project_name"]
+    repo_url = job.params["repo_url"]
+    branch = job.params.get("branch", "main")
+    project_path = os.path.join(PROJECTS_DIR, project_name)
+    
+    try:
+        if get_project_record(project_name):
+            log_action(f"API: Обновление существующего проекта {project_name}", project=project_name)
+            action = "обновлен"
+        else:
+            log_action(f"API: Создание нового проекта {project_name}", project=project_name)
+            action = "создан"
+        
+        os.makedirs(project_path, exist_ok=True)
+        download, success, deps_msg = run_job_pipeline(job, project_name, repo_url, branch, project_path)
+        
+        job.checkpoint("save")
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        save_project_record(
+            project_name,
+            {'repo_url': repo_url, 'branch': branch, 'path': project_path, 'last_update': now},
+            increment={'deploy_count': 1},
+            defaults={'created': now}
+        )
+        
+        log_action(f"API: Проект {project_name} успешно {action}", project=project_name)
+        
+        return {
+            "action": action,
+            "project": project_name,
+            "message": f"Проект {project_name} успешно {action}!",
+            "dependencies": deps_msg,
+            "commit": download.get("commit"),
+            "path": project_path,
+            "info": get_project_info(project_path)
+        }
+    except JobCancelled:
+        raise
+    except Exception as e:
+        count_event("errors", project=project_name)
+        log_action(f"API: ОШИБКА деплоя {project_name}: {str(e)}", "ERROR", project=project_name)
+        raise
+
+@job_queue.handler("update")
+def run_update_job(job):
+    """Задача обновления проекта (из API или webhook)"""
+    name = job.project
+    source = job.params.get("source", "API")
+    counter = 'webhook_updates' if source == "Webhook" else 'update_count'
+    
+    try:
+        project = get_project_record(name)
+        if not project:
+            raise Exception("Проект не найден")
+        
+        log_action(f"{source}: Начато обновление проекта {name}", project=name)
+        download, success, deps_msg = run_job_pipeline(
+            job, name, project['repo_url'], project['branch'], project['path']
+        )
+        
+        job.checkpoint("save")
+        save_project_record(
+            name,
+            {'last_update': datetime.now().strftime("%Y-%m-%d %H:%M:%S")},
+            increment={counter: 1},
+            create=False
+        )
+        
+        count_event("updates", project=name)
+        log_action(f"{source}: Проект {name} успешно обновлен", project=name)
+        
+        return {
+            "project": name,
+            "message": f"Проект {name} обновлен!",
+            "dependencies": deps_msg,
+            "commit": download.get("commit"),
+            "skipped": download.get("skipped", False),
+            "info": get_project_info(project['path'])
+        }
+    except JobCancelled:
+        raise
+    except Exception as e:
+        count_event("errors", project=name)
+        log_action(f"{source}: ОШИБКА обновления {name}: {str(e)}", "ERROR", project=name)
+        raise
+
+# === МАССОВОЕ ОБНОВЛЕНИЕ ===
+
+class AdaptiveLimiter:
+    """Ограничитель параллельности: уменьшается при ошибках и росте задержек GitHub, растёт при успехах"""
+    
+    def __init__(self, max_limit, adaptive=True):
+        self.max_limit = max(1, max_limit)
+        self.limit = self.max_limit
+        self.adaptive = adaptive
+        self.active = 0
+        self.latency_ewma = None
+        self.condition = threading.Condition()
+    
+    def acquire(self):
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+    
+    def release(self, latency=None, error=False):
+        with self.condition:
+            self.active -= 1
+            if self.adaptive:
+                slow = latency is not None and self.latency_ewma is not None and latency > 2 * self.latency_ewma
+                if error or slow:
+                    self.limit = max(1, self.limit // 2)
+                elif self.limit < self.max_limit:
+                    self.limit += 1
+                if latency is not None:
+                    self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+            self.condition.notify_all()
+
+def _update_project_limited(name, project, limiter):
+    """Обновление одного проекта с учётом ограничителя параллельности"""
+    limiter.acquire()
+    started = time.monotonic()
+    latency = None
+    failed = True
+    try:
+        log_action(f"Mass update: {name}", project=name)
+        download = download_repo_from_github(project['repo_url'], project['branch'], project['path'])
+        # Задержка учитывается только для реально скачанных архивов: пропуски (ветка не изменилась)
+        # и архивы из кэша занимают доли секунды и занизили бы среднее
+        if download.get("bytes"):
+            latency = time.monotonic() - started
+        failed = False
+        success, deps_msg = install_requirements(project['path'], name)
+        return {
+            "ok": True,
+            "skipped": download.get("skipped", False),
+            "deps_ok": success,
+            "dependencies": deps_msg,
+            "duration": round(time.monotonic() - started, 2)
+        }
+    except Exception as e:
+        log_action(f"Mass update error for {name}: {str(e)}", "ERROR", project=name)
+        return {"ok": False, "error": str(e), "duration": round(time.monotonic() - started, 2)}
+    finally:
+        limiter.release(latency, error=failed)
+
+def update_projects_parallel(projects, concurrency=None, adaptive=None):
+    """Параллельное обновление проектов с ограничением; возвращает результаты по каждому проекту"""
+    concurrency = concurrency or UPDATE_ALL_CONCURRENCY
+    limiter = AdaptiveLimiter(concurrency, UPDATE_ALL_ADAPTIVE if adaptive is None else adaptive)
+    
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="mass-update") as pool:
+        futures = {
+            name: pool.submit(_update_project_limited, name, project, limiter)
+            for name, project in projects.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+# === ИСПОЛНЕНИЕ БЛОКИРУЮЩИХ ОПЕРАЦИЙ БОТА ===
+
+blocking_executor = ThreadPoolExecutor(max_workers=BOT_BLOCKING_WORKERS, thread_name_prefix="bot-blocking")
+bot_latency = {"handlers": {}, "loop_lag_max": 0.0, "loop_lag_last": 0.0}
+
+async def run_blocking(func, *args, **kwargs):
+    """Выполнение блокирующей функции в пуле потоков, не останавливая event loop бота"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_executor, functools.partial(func, *args, **kwargs))
+
+def record_handler_latency(handler_name, duration):
+    stats = bot_latency["handlers"].setdefault(handler_name, {"count": 0, "total": 0.0, "max": 0.0})
+    stats["count"] += 1
+    stats["total"] += duration
+    stats["max"] = max(stats["max"], duration)
+    bot_handler_seconds.observe(duration, handler_name)
+    if duration > SLOW_HANDLER_SECONDS:
+        logger.warning(f"Медленный хендлер {handler_name}: {duration:.2f} с")
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Замер времени выполнения хендлеров бота"""
+    
+    async def __call__(self, handler, event, data):
+        started = time.monotonic()
+        try:
+            return await handler(event, data)
+        finally:
+            handler_object = data.get("handler")
+            handler_name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+            record_handler_latency(handler_name, time.monotonic() - started)
+
+async def monitor_event_loop_lag(interval=1.0, flush_every=10):
+    """Фоновый замер задержки event loop: показывает, не блокирует ли что-то бота"""
+    ticks = 0
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.monotonic() - started - interval)
+        bot_latency["loop_lag_last"] = round(lag, 4)
+        bot_latency["loop_lag_max"] = round(max(bot_latency["loop_lag_max"], lag), 4)
+        if lag > SLOW_HANDLER_SECONDS:
+            logger.warning(f"Event loop бота был заблокирован на {lag:.2f} с")
+        
+        ticks += 1
+        if ticks % flush_every == 0:
+            await run_blocking(set_setting, "bot_latency", get_bot_latency_summary())
+
+def get_bot_latency_summary():
+    """Задержки бота; веб-воркеры gunicorn читают последнюю сводку, сохранённую процессом бота"""
+    if not bot_process:
+        return get_setting("bot_latency") or {"loop_lag_last": 0.0, "loop_lag_max": 0.0, "handlers": {}}
+    return {
+        "loop_lag_last": bot_latency["loop_lag_last"],
+        "loop_lag_max": bot_latency["loop_lag_max"],
+        "handlers": {
+            name: {
+                "count": stats["count"],
+                "avg": round(stats["total"] / stats["count"], 4) if stats["count"] else 0,
+                "max": round(stats["max"], 4)
+            }
+            for name, stats in list(bot_latency["handlers"].items())
+        }
+    }
+
+def get_projects_totals():
+    """Число проектов и суммарная статистика по ним (через кэш агрегатов)"""
+    def compute():
+        projects = list_project_records()
+        return {"projects": len(projects), **collect_projects_stats(projects)}
+    return aggregate_cache.get("projects_totals", compute)
+
+def collect_enhanced_projects():
+    """Все проекты с дополнительной информацией о файлах"""
+    return {
+        name: {**project, **get_project_info(project.get('path', ''))}
+        for name, project in list_project_records().items()
+    }
+
+# Поля из get_project_info: вычисляются (через кэш агрегатов), только если запрошены
+PROJECT_INFO_FIELDS = ("files_count", "size_mb", "last_modified", "has_requirements", "python_files")
+PROJECT_SORT_FIELDS = ("name", "branch", "created", "last_update") + PROJECT_INFO_FIELDS
+
+def _last_update_age_hours(project, now):
+    try:
+        return (now - datetime.strptime(project.get('last_update') or '', "%Y-%m-%d %H:%M:%S")).total_seconds() / 3600
+    except ValueError:
+        return None
+
+def query_projects(fields=None, sort="name", branch=None, max_age_hours=None, min_age_hours=None,
+                   limit=None, cursor=None):
+    """Выборка проектов: поля fields (None - все), сортировка sort ("-" - по убыванию), фильтры по ветке
+    и давности последнего обновления, страницы limit/cursor (cursor - имя последнего проекта страницы).
+    Возвращает (проекты, курсор следующей страницы, всего подходящих)"""
+    descending = sort.startswith('-')
+    sort_field = sort.lstrip('-')
+    if sort_field not in PROJECT_SORT_FIELDS:
+        raise ValueError(f"Неизвестное поле сортировки: {sort_field}")
+    
+    need_info = fields is None or sort_field in PROJECT_INFO_FIELDS or any(f in PROJECT_INFO_FIELDS for f in fields)
+    projects = aggregate_cache.get("projects_enhanced", collect_enhanced_projects) if need_info else list_project_records()
+    
+    def sort_key(name):
+        value = name if sort_field == "name" else projects[name].get(sort_field)
+        # Проекты без значения - в конце (при сортировке по убыванию - в начале)
+        return (value is None, value if value is not None else ''), name
+    
+    now = datetime.now()
+    selected = []
+    for name, project in projects.items():
+        if branch and project.get('branch') != branch:
+            continue
+        if max_age_hours is not None or min_age_hours is not None:
+            age = _last_update_age_hours(project, now)
+            if age is None or (max_age_hours is not None and age > max_age_hours) \
+                    or (min_age_hours is not None and age < min_age_hours):
+                continue
+        selected.append(name)
+    selected.sort(key=sort_key, reverse=descending)
+    total = len(selected)
+    
+    if cursor:
+        if cursor in projects:
+            cursor_key = sort_key(cursor)
+        elif sort_field == "name":
+            cursor_key = ((False, cursor), cursor)
+        else:
+            raise ValueError("Курсор устарел: проект удалён")
+        selected = [name for name in selected if (sort_key(name) < cursor_key if descending else sort_key(name) > cursor_key)]
+    
+    page = selected[:limit] if limit else selected
+    next_cursor = page[-1] if limit and len(selected) > limit else None
+    items = [
+        {"name": name, **{key: value for key, value in projects[name].items() if fields is None or key in fields}}
+        for name in page
+    ]
+    return items, next_cursor, total
+
+def collect_projects_stats(projects):
+    """Суммарная статистика по всем проектам"""
+    totals = {"total_size": 0, "total_files": 0, "python_files": 0}
+    for project in projects.values():
+        if project.get('path') and os.path.exists(project['path']):
+            info = get_project_info(project['path'])
+            totals["total_size"] += info['size_mb']
+            totals["total_files"] += info['files_count']
+            totals["python_files"] += info['python_files']
+    return totals
+
+dp.message.middleware(HandlerTimingMiddleware())
+dp.callback_query.middleware(HandlerTimingMiddleware())
+
 # === TELEGRAM BOT HANDLERS (улучшенные) ===
 
 @dp.message(Command("start"))
@@ -243,8 +2960,7 @@ async def cmd_start(message: types.Message):
         await message.answer("❌ У вас нет доступа к этому боту.")
         return
     
-    config = load_config()
-    projects_count = len(config.get('projects', {}))
+    projects_count = count_project_records()
     
     keyboard = InlineKeyboardBuilder()
     keyboard.add(
@@ -257,6 +2973,7 @@ async def cmd_start(message: types.Message):
     )
     keyboard.adjust(2, 1, 2, 1)
     
+    system_stats = get_system_stats()
     uptime = datetime.now() - system_stats["start_time"]
     uptime_str = str(uptime).split('.')[0]
     
@@ -271,12 +2988,17 @@ async def cmd_start(message: types.Message):
     
     await message.answer(response_text, parse_mode="HTML", reply_markup=keyboard.as_markup())
 
-@dp.callback_query(F.data == "list_projects")
+@dp.callback_query(F.data.startswith("list_projects"))
 async def show_projects(callback: CallbackQuery):
-    config = load_config()
-    projects = config.get('projects', {})
+    # list_projects - первая страница, list_projects:<имя> - страница после этого проекта
+    cursor = callback.data.partition(":")[2] or None
+    projects, next_cursor, total = await run_blocking(
+        query_projects,
+        fields={"repo_url", "branch", "last_update", "files_count", "size_mb"},
+        limit=BOT_PROJECTS_PAGE_SIZE, cursor=cursor
+    )
     
-    if not projects:
+    if not total:
         await callback.message.edit_text(
             "📦 <b>Проекты</b>\n\n"
             "❌ Пока нет проектов\n\n"
@@ -289,17 +3011,16 @@ async def show_projects(callback: CallbackQuery):
         )
         return
     
-    text = "📦 <b>Мои проекты:</b>\n\n"
+    text = f"📦 <b>Мои проекты</b> ({total}):\n\n"
     keyboard = InlineKeyboardBuilder()
     
-    for name, info in list(projects.items())[:6]:  # Показываем до 6 проектов
-        project_info = get_project_info(info.get('path', ''))
-        
+    for info in projects:
+        name = info['name']
         text += f"▪️ <b>{name}</b>\n"
         text += f"   🔗 {info.get('repo_url', 'N/A')[:45]}...\n"
         text += f"   🌿 {info.get('branch', 'main')} • "
-        text += f"📁 {project_info['files_count']} файлов • "
-        text += f"💾 {project_info['size_mb']} MB\n"
+        text += f"📁 {info['files_count']} файлов • "
+        text += f"💾 {info['size_mb']} MB\n"
         text += f"   🕐 {info.get('last_update', 'Никогда')}\n\n"
         
         keyboard.add(InlineKeyboardButton(
@@ -307,15 +3028,19 @@ async def show_projects(callback: CallbackQuery):
             callback_data=f"manage_{name}"
         ))
     
-    if len(projects) > 6:
-        text += f"... и ещё {len(projects) - 6} проектов\n\n"
+    pages = []
+    if cursor:
+        pages.append(InlineKeyboardButton(text="⏮ В начало", callback_data="list_projects"))
+    if next_cursor:
+        pages.append(InlineKeyboardButton(text="➡️ Далее", callback_data=f"list_projects:{next_cursor}"))
+    keyboard.add(*pages)
     
     keyboard.add(
         InlineKeyboardButton(text="🚀 Новый проект", callback_data="deploy_start"),
         InlineKeyboardButton(text="🔄 Обновить все", callback_data="update_all"),
         InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_main")
     )
-    keyboard.adjust(2, 2, 1)
+    keyboard.adjust(*([2] * ((len(projects) + 1) // 2)), *([len(pages)] if pages else []), 2, 1)
     
     response_text = safe_message_send(text)
     await callback.message.edit_text(response_text, parse_mode="HTML", reply_markup=keyboard.as_markup())
@@ -323,13 +3048,12 @@ async def show_projects(callback: CallbackQuery):
 @dp.callback_query(F.data.startswith("manage_"))
 async def manage_project(callback: CallbackQuery):
     project_name = callback.data.split("manage_")[1]
-    config = load_config()
+    project = get_project_record(project_name)
     
-    if project_name not in config['projects']:
+    if not project:
         await callback.answer("❌ Проект не найден")
         return
-    
-    project = config['projects'][project_name]
+
     project_info = get_project_info(project['path'])
     
     text = f"⚙️ <b>Проект: {project_name}</b>\n\n"
@@ -348,14 +3072,15 @@ async def manage_project(callback: CallbackQuery):
         InlineKeyboardButton(text="📁 Файлы", callback_data=f"files_{project_name}"),
         InlineKeyboardButton(text="📋 Логи", callback_data=f"project_logs_{project_name}"),
         InlineKeyboardButton(text="⚙️ Настройки", callback_data=f"project_settings_{project_name}"),
+        InlineKeyboardButton(text="♻️ Переустановить зависимости", callback_data=f"reinstall_{project_name}"),
         InlineKeyboardButton(text="🗑️ Удалить", callback_data=f"delete_{project_name}"),
         InlineKeyboardButton(text="🔙 К проектам", callback_data="list_projects")
     )
-    keyboard.adjust(2, 2, 1, 1)
+    keyboard.adjust(2, 2, 1, 1, 1)
     
     await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard.as_markup())
 
-@dp.callback_query(F.data.startswith("update_"))
+@dp.callback_query(F.data.startswith("update_"), F.data != "update_all")
 async def update_project(callback: CallbackQuery):
     project_name = callback.data.split("update_")[1]
     
@@ -363,22 +3088,26 @@ async def update_project(callback: CallbackQuery):
         await callback.answer("🔄 Обновление...")
         await callback.message.edit_text("🔄 <b>Обновление проекта...</b>\n\nПодождите, это может занять время.", parse_mode="HTML")
         
-        config = load_config()
-        project = config['projects'][project_name]
+        project = get_project_record(project_name)
+        if not project:
+            raise Exception("Проект не найден")
         
-        log_action(f"Bot: Начато обновление {project_name}")
+        log_action(f"Bot: Начато обновление {project_name}", project=project_name)
         
         # Скачиваем обновления
-        download_repo_from_github(project['repo_url'], project['branch'], project['path'])
+        await run_blocking(download_repo_from_github, project['repo_url'], project['branch'], project['path'])
         
         # Устанавливаем зависимости
-        success, deps_msg = install_requirements(project['path'], project_name)
+        success, deps_msg = await run_blocking(install_requirements, project['path'], project_name)
         
         # Обновляем конфиг
-        config['projects'][project_name]['last_update'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        save_config(config)
+        save_project_record(
+            project_name,
+            {'last_update': datetime.now().strftime("%Y-%m-%d %H:%M:%S")},
+            create=False
+        )
         
-        system_stats["updates"] += 1
+        count_event("updates", project=project_name)
         
         status_emoji = "✅" if success else "⚠️"
         
@@ -393,11 +3122,11 @@ async def update_project(callback: CallbackQuery):
             ]])
         )
         
-        log_action(f"Bot: Обновление {project_name} завершено")
+        log_action(f"Bot: Обновление {project_name} завершено", project=project_name)
         
     except Exception as e:
-        system_stats["errors"] += 1
-        log_action(f"Bot: Ошибка обновления {project_name}: {str(e)}", "ERROR")
+        count_event("errors", project=project_name)
+        log_action(f"Bot: Ошибка обновления {project_name}: {str(e)}", "ERROR", project=project_name)
         await callback.message.edit_text(
             f"❌ <b>Ошибка обновления {project_name}:</b>\n\n"
             f"<code>{str(e)[:300]}</code>",
@@ -407,10 +3136,36 @@ async def update_project(callback: CallbackQuery):
             ]])
         )
 
+@dp.callback_query(F.data.startswith("reinstall_"))
+async def reinstall_requirements(callback: CallbackQuery):
+    project_name = callback.data.split("reinstall_", 1)[1]
+    project = get_project_record(project_name)
+    
+    if not project:
+        await callback.answer("❌ Проект не найден")
+        return
+
+    await callback.answer("♻️ Переустановка зависимостей...")
+    await callback.message.edit_text(
+        f"♻️ <b>Переустановка зависимостей {project_name}...</b>\n\nПодождите, это может занять время.",
+        parse_mode="HTML"
+    )
+    
+    log_action(f"Bot: Принудительная установка зависимостей {project_name}", project=project_name)
+    success, deps_msg = await run_blocking(install_requirements, project['path'], project_name, force=True)
+    
+    await callback.message.edit_text(
+        f"{'✅' if success else '❌'} <b>Зависимости {project_name}</b>\n\n"
+        f"<code>{deps_msg[:300]}</code>",
+        parse_mode="HTML",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="🔙 К проекту", callback_data=f"manage_{project_name}")
+        ]])
+    )
+
 @dp.callback_query(F.data == "update_all")
 async def update_all_projects(callback: CallbackQuery):
-    config = load_config()
-    projects = config.get('projects', {})
+    projects = list_project_records()
     
     if not projects:
         await callback.answer("❌ Нет проектов для обновления")
@@ -424,27 +3179,25 @@ async def update_all_projects(callback: CallbackQuery):
         parse_mode="HTML"
     )
     
-    updated = 0
-    errors = 0
-    
-    for name, project in projects.items():
-        try:
-            log_action(f"Mass update: {name}")
-            download_repo_from_github(project['repo_url'], project['branch'], project['path'])
-            install_requirements(project['path'], name)
-            config['projects'][name]['last_update'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            updated += 1
-        except Exception as e:
-            log_action(f"Mass update error for {name}: {str(e)}", "ERROR")
-            errors += 1
+    results = await run_blocking(update_projects_parallel, projects)
     
-    save_config(config)
+    # Результаты сохраняются одной транзакцией после всех обновлений
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    bulk_update_project_records({
+        name: {'last_update': now} for name, result in results.items() if result["ok"]
+    })
+    
+    updated = sum(1 for result in results.values() if result["ok"])
+    errors = len(results) - updated
+    unchanged = sum(1 for result in results.values() if result.get("skipped"))
+    failed_names = [name for name, result in results.items() if not result["ok"]]
     
     await callback.message.edit_text(
         f"✅ <b>Массовое обновление завершено!</b>\n\n"
-        f"✅ Обновлено: {updated}\n"
+        f"✅ Обновлено: {updated} (без изменений: {unchanged})\n"
         f"❌ Ошибок: {errors}\n"
-        f"🕐 Время: {datetime.now().strftime('%H:%M:%S')}",
+        + (f"⚠️ {', '.join(failed_names[:10])}\n" if failed_names else "")
+        + f"🕐 Время: {datetime.now().strftime('%H:%M:%S')}",
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
             InlineKeyboardButton(text="📦 Проекты", callback_data="list_projects"),
@@ -456,28 +3209,20 @@ async def update_all_projects(callback: CallbackQuery):
 
 @dp.callback_query(F.data == "stats")
 async def show_stats(callback: CallbackQuery):
-    config = load_config()
-    projects = config.get('projects', {})
-    
+    system_stats = get_system_stats()
     uptime = datetime.now() - system_stats["start_time"]
     uptime_str = str(uptime).split('.')[0]
     
     # Статистика проектов
-    total_size = 0
-    total_files = 0
-    python_files = 0
-    
-    for project in projects.values():
-        if project.get('path') and os.path.exists(project['path']):
-            info = get_project_info(project['path'])
-            total_size += info['size_mb']
-            total_files += info['files_count']
-            python_files += info['python_files']
+    totals = await run_blocking(get_projects_totals)
+    total_size = totals["total_size"]
+    total_files = totals["total_files"]
+    python_files = totals["python_files"]
     
     await callback.message.edit_text(
         "📊 <b>Статистика системы</b>\n\n"
         f"⏱️ <b>Время работы:</b> {uptime_str}\n"
-        f"📦 <b>Проектов:</b> {len(projects)}\n"
+        f"📦 <b>Проектов:</b> {totals['projects']}\n"
         f"📁 <b>Всего файлов:</b> {total_files}\n"
         f"🐍 <b>Python файлов:</b> {python_files}\n"
         f"💾 <b>Общий размер:</b> {total_size:.1f} MB\n"
@@ -508,705 +3253,135 @@ async def back_to_main(callback: CallbackQuery):
 
 # === FLASK ROUTES (полные) ===
 
-@app.route('/')
-def index():
-    logger.info("🏠 Загрузка главной страницы")
-    config = load_config()
-    projects = config.get('projects', {})
-    
-    return render_template_string("""
-<!DOCTYPE html>
-<html lang="ru">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Deploy Manager Pro v4.0</title>
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css">
-    <style>
-        :root {
-            --primary: #667eea;
-            --secondary: #764ba2;
-            --success: #28a745;
-            --warning: #ffc107;
-            --danger: #dc3545;
-            --info: #17a2b8;
-            --dark: #343a40;
-            --light: #f8f9fa;
-        }
-        
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        
-        body { 
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif;
-            background: linear-gradient(135deg, var(--primary) 0%, var(--secondary) 100%);
-            min-height: 100vh;
-            color: #333;
-        }
-        
-        .navbar {
-            background: rgba(255,255,255,0.95);
-            backdrop-filter: blur(20px);
-            padding: 1rem 0;
-            box-shadow: 0 2px 20px rgba(0,0,0,0.1);
-            position: sticky;
-            top: 0;
-            z-index: 1000;
-        }
-        
-        .nav-container {
-            max-width: 1200px;
-            margin: 0 auto;
-            padding: 0 20px;
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-        }
-        
-        .logo {
-            font-size: 1.5rem;
-            font-weight: 700;
-            background: linear-gradient(135deg, var(--primary), var(--secondary));
-            -webkit-background-clip: text;
-            -webkit-text-fill-color: transparent;
-        }
-        
-        .nav-links {
-            display: flex;
-            gap: 2rem;
-            list-style: none;
-        }
-        
-        .nav-links a {
-            text-decoration: none;
-            color: #333;
-            font-weight: 500;
-            transition: color 0.3s;
-        }
-        
-        .nav-links a:hover {
-            color: var(--primary);
-        }
-        
-        .container {
-            max-width: 1200px;
-            margin: 0 auto;
-            padding: 2rem;
-        }
-        
-        .hero {
-            text-align: center;
-            padding: 3rem 0;
-            color: white;
-        }
-        
-        .hero h1 {
-            font-size: 3.5rem;
-            margin-bottom: 1rem;
-            text-shadow: 0 4px 20px rgba(0,0,0,0.3);
-        }
-        
-        .hero p {
-            font-size: 1.3rem;
-            margin-bottom: 2rem;
-            opacity: 0.9;
-        }
-        
-        .stats-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(250px, 1fr));
-            gap: 2rem;
-            margin: 3rem 0;
-        }
-        
-        .stat-card {
-            background: rgba(255,255,255,0.95);
-            backdrop-filter: blur(20px);
-            padding: 2rem;
-            border-radius: 20px;
-            text-align: center;
-            box-shadow: 0 8px 32px rgba(0,0,0,0.1);
-            border: 1px solid rgba(255,255,255,0.2);
-            transition: transform 0.3s ease;
-        }
-        
-        .stat-card:hover {
-            transform: translateY(-5px);
-        }
-        
-        .stat-icon {
-            font-size: 3rem;
-            margin-bottom: 1rem;
-            background: linear-gradient(135deg, var(--primary), var(--secondary));
-            -webkit-background-clip: text;
-            -webkit-text-fill-color: transparent;
-        }
-        
-        .stat-number {
-            font-size: 2.5rem;
-            font-weight: 700;
-            color: var(--primary);
-            display: block;
-        }
-        
-        .stat-label {
-            font-size: 1.1rem;
-            color: #666;
-            margin-top: 0.5rem;
-        }
-        
-        .features-section {
-            background: rgba(255,255,255,0.95);
-            backdrop-filter: blur(20px);
-            border-radius: 20px;
-            padding: 3rem;
-            margin: 3rem 0;
-            box-shadow: 0 8px 32px rgba(0,0,0,0.1);
-        }
-        
-        .features-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(300px, 1fr));
-            gap: 2rem;
-            margin-top: 2rem;
-        }
-        
-        .feature-card {
-            padding: 2rem;
-            border-radius: 15px;
-            background: #f8f9fa;
-            border-left: 5px solid var(--primary);
-        }
-        
-        .feature-icon {
-            font-size: 2.5rem;
-            color: var(--primary);
-            margin-bottom: 1rem;
-        }
-        
-        .deploy-section {
-            background: rgba(255,255,255,0.95);
-            backdrop-filter: blur(20px);
-            border-radius: 20px;
-            padding: 3rem;
-            margin: 3rem 0;
-            box-shadow: 0 8px 32px rgba(0,0,0,0.1);
-        }
-        
-        .form-group {
-            margin: 1.5rem 0;
-        }
-        
-        .form-group label {
-            display: block;
-            margin-bottom: 0.5rem;
-            font-weight: 600;
-            color: #333;
-        }
-        
-        .form-control {
-            width: 100%;
-            padding: 1rem;
-            border: 2px solid #e9ecef;
-            border-radius: 10px;
-            font-size: 1rem;
-            transition: border-color 0.3s;
-        }
-        
-        .form-control:focus {
-            outline: none;
-            border-color: var(--primary);
-            box-shadow: 0 0 0 3px rgba(102, 126, 234, 0.1);
-        }
-        
-        .btn {
-            display: inline-block;
-            padding: 1rem 2rem;
-            border: none;
-            border-radius: 10px;
-            font-size: 1rem;
-            font-weight: 600;
-            text-decoration: none;
-            cursor: pointer;
-            transition: all 0.3s;
-            text-transform: uppercase;
-            letter-spacing: 0.5px;
-        }
-        
-        .btn-primary {
-            background: linear-gradient(135deg, var(--primary), var(--secondary));
-            color: white;
-        }
-        
-        .btn-success { background: var(--success); color: white; }
-        .btn-info { background: var(--info); color: white; }
-        .btn-warning { background: var(--warning); color: #333; }
-        .btn-danger { background: var(--danger); color: white; }
-        
-        .btn:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 5px 15px rgba(0,0,0,0.2);
-        }
-        
-        .projects-section {
-            margin: 3rem 0;
-        }
-        
-        .project-card {
-            background: rgba(255,255,255,0.95);
-            backdrop-filter: blur(20px);
-            border-radius: 15px;
-            padding: 2rem;
-            margin: 1rem 0;
-            box-shadow: 0 4px 20px rgba(0,0,0,0.1);
-            border-left: 5px solid var(--primary);
-        }
-        
-        .project-header {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            margin-bottom: 1rem;
-        }
-        
-        .project-title {
-            font-size: 1.5rem;
-            font-weight: 600;
-            color: var(--primary);
-        }
-        
-        .project-status {
-            padding: 0.5rem 1rem;
-            border-radius: 20px;
-            font-size: 0.9rem;
-            font-weight: 500;
-        }
-        
-        .status-active { background: #d4edda; color: #155724; }
-        .status-updating { background: #fff3cd; color: #856404; }
-        
-        .project-info {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-            gap: 1rem;
-            margin: 1rem 0;
-            font-size: 0.9rem;
-            color: #666;
-        }
-        
-        .project-actions {
-            display: flex;
-            gap: 1rem;
-            margin-top: 1.5rem;
-        }
-        
-        .btn-sm {
-            padding: 0.5rem 1rem;
-            font-size: 0.9rem;
-        }
-        
-        .alert {
-            padding: 1rem;
-            border-radius: 10px;
-            margin: 1rem 0;
-            border-left: 5px solid;
-        }
-        
-        .alert-success {
-            background: #d4edda;
-            color: #155724;
-            border-color: #28a745;
-        }
-        
-        .alert-error {
-            background: #f8d7da;
-            color: #721c24;
-            border-color: #dc3545;
-        }
-        
-        .loading {
-            display: inline-block;
-            width: 20px;
-            height: 20px;
-            border: 3px solid rgba(255,255,255,0.3);
-            border-radius: 50%;
-            border-top-color: white;
-            animation: spin 1s ease-in-out infinite;
-        }
-        
-        @keyframes spin {
-            to { transform: rotate(360deg); }
-        }
-        
-        .footer {
-            text-align: center;
-            padding: 3rem 0;
-            color: rgba(255,255,255,0.8);
-        }
-        
-        @media (max-width: 768px) {
-            .nav-container { flex-direction: column; gap: 1rem; }
-            .nav-links { flex-direction: column; text-align: center; }
-            .hero h1 { font-size: 2.5rem; }
-            .container { padding: 1rem; }
-            .project-header { flex-direction: column; align-items: flex-start; gap: 1rem; }
-            .project-actions { flex-direction: column; }
-        }
-    </style>
-</head>
-<body>
-    <nav class="navbar">
-        <div class="nav-container">
-            <div class="logo">
-                <i class="fas fa-rocket"></i> Deploy Manager Pro v4.0
-            </div>
-            <ul class="nav-links">
-                <li><a href="#projects"><i class="fas fa-project-diagram"></i> Проекты</a></li>
-                <li><a href="#deploy"><i class="fas fa-cloud-upload-alt"></i> Деплой</a></li>
-                <li><a href="/api/logs" target="_blank"><i class="fas fa-file-alt"></i> Логи</a></li>
-                <li><a href="/health" target="_blank"><i class="fas fa-heartbeat"></i> Статус</a></li>
-            </ul>
-        </div>
-    </nav>
-
-    <div class="hero">
-        <div class="container">
-            <h1><i class="fas fa-rocket"></i> Deploy Manager Pro</h1>
-            <p>Профессиональная система управления деплоем на BotHost</p>
-        </div>
-    </div>
-
-    <div class="container">
-        <div class="stats-grid">
-            <div class="stat-card">
-                <div class="stat-icon"><i class="fas fa-project-diagram"></i></div>
-                <span class="stat-number" id="projectsCount">{{ projects|length }}</span>
-                <div class="stat-label">Активных проектов</div>
-            </div>
-            <div class="stat-card">
-                <div class="stat-icon"><i class="fas fa-cloud-upload-alt"></i></div>
-                <span class="stat-number" id="deploysCount">{{ stats.deploys }}</span>
-                <div class="stat-label">Всего деплоев</div>
-            </div>
-            <div class="stat-card">
-                <div class="stat-icon"><i class="fas fa-sync-alt"></i></div>
-                <span class="stat-number" id="updatesCount">{{ stats.updates }}</span>
-                <div class="stat-label">Обновлений</div>
-            </div>
-            <div class="stat-card">
-                <div class="stat-icon"><i class="fas fa-clock"></i></div>
-                <span class="stat-number" id="uptime">Online</span>
-                <div class="stat-label">Статус системы</div>
-            </div>
-        </div>
-
-        <div class="features-section">
-            <h2><i class="fas fa-star"></i> Возможности системы</h2>
-            <div class="features-grid">
-                <div class="feature-card">
-                    <div class="feature-icon"><i class="fab fa-github"></i></div>
-                    <h3>GitHub интеграция</h3>
-                    <p>Прямая загрузка репозиториев через HTTP API без Git клиента. Поддержка автообновлений через webhooks.</p>
-                </div>
-                <div class="feature-card">
-                    <div class="feature-icon"><i class="fas fa-telegram-plane"></i></div>
-                    <h3>Telegram управление</h3>
-                    <p>Полное управление через Telegram бота: деплой, обновления, мониторинг и настройки.</p>
-                </div>
-                <div class="feature-card">
-                    <div class="feature-icon"><i class="fas fa-cogs"></i></div>
-                    <h3>Автоматизация</h3>
-                    <p>Автоустановка зависимостей, обработка requirements.txt, логирование всех операций.</p>
-                </div>
-                <div class="feature-card">
-                    <div class="feature-icon"><i class="fas fa-chart-line"></i></div>
-                    <h3>Мониторинг</h3>
-                    <p>Детальная статистика, логи в реальном времени, информация о проектах и системе.</p>
-                </div>
-            </div>
-        </div>
-
-        <div class="deploy-section" id="deploy">
-            <h2><i class="fas fa-rocket"></i> Быстрый деплой</h2>
-            <p>Деплой нового проекта из GitHub репозитория</p>
-            
-            <form id="deployForm">
-                <div class="form-group">
-                    <label for="projectName"><i class="fas fa-tag"></i> Название проекта</label>
-                    <input type="text" id="projectName" class="form-control" placeholder="my-awesome-project" required>
-                </div>
-                
-                <div class="form-group">
-                    <label for="repoUrl"><i class="fab fa-github"></i> GitHub URL</label>
-                    <input type="url" id="repoUrl" class="form-control" placeholder="https://github.com/username/repository.git" required>
-                </div>
-                
-                <div class="form-group">
-                    <label for="branch"><i class="fas fa-code-branch"></i> Ветка</label>
-                    <input type="text" id="branch" class="form-control" placeholder="main" value="main">
-                </div>
-                
-                <button type="submit" class="btn btn-primary">
-                    <i class="fas fa-rocket"></i> Запустить деплой
-                </button>
-            </form>
-            
-            <div id="deployStatus"></div>
-        </div>
-
-        <div class="projects-section" id="projects">
-            <h2><i class="fas fa-project-diagram"></i> Мои проекты</h2>
-            <div id="projectsList">
-                <div class="loading" style="margin: 2rem auto;"></div>
-            </div>
-        </div>
-    </div>
-
-    <div class="footer">
-        <div class="container">
-            <p><strong>Deploy Manager Pro v4.0</strong></p>
-            <p>BotHost Compatible • Full-Featured • Production Ready</p>
-            <p><i class="fas fa-heart" style="color: #ff6b6b;"></i> Made with Love for Developers</p>
-        </div>
-    </div>
-
-    <script>
-        // Обновление статистики в реальном времени
-        function updateStats() {
-            fetch('/api/stats')
-                .then(r => r.json())
-                .then(data => {
-                    document.getElementById('projectsCount').textContent = data.projects || 0;
-                    document.getElementById('deploysCount').textContent = data.deploys || 0;
-                    document.getElementById('updatesCount').textContent = data.updates || 0;
-                    document.getElementById('uptime').textContent = data.uptime || 'Online';
-                })
-                .catch(err => console.log('Ошибка загрузки статистики:', err));
-        }
+# === ДАШБОРД И СТАТИКА (шаблон и ассеты с отпечатками) ===
 
-        // Загрузка проектов
-        function loadProjects() {
-            fetch('/api/projects')
-                .then(r => r.json())
-                .then(data => {
-                    const projectsList = document.getElementById('projectsList');
-                    
-                    if (Object.keys(data).length === 0) {
-                        projectsList.innerHTML = `
-                            <div class="project-card">
-                                <div style="text-align: center; padding: 2rem;">
-                                    <i class="fas fa-inbox" style="font-size: 3rem; color: #ddd; margin-bottom: 1rem;"></i>
-                                    <h3>Пока нет проектов</h3>
-                                    <p>Используйте форму выше для деплоя первого проекта</p>
-                                </div>
-                            </div>
-                        `;
-                        return;
-                    }
-
-                    let html = '';
-                    for (const [name, info] of Object.entries(data)) {
-                        html += `
-                            <div class="project-card">
-                                <div class="project-header">
-                                    <div class="project-title">
-                                        <i class="fas fa-folder"></i> ${name}
-                                    </div>
-                                    <div class="project-status status-active">
-                                        <i class="fas fa-check-circle"></i> Активен
-                                    </div>
-                                </div>
-                                
-                                <div class="project-info">
-                                    <div><i class="fab fa-github"></i> <strong>Репозиторий:</strong> ${info.repo_url}</div>
-                                    <div><i class="fas fa-code-branch"></i> <strong>Ветка:</strong> ${info.branch}</div>
-                                    <div><i class="fas fa-clock"></i> <strong>Обновлено:</strong> ${info.last_update || 'Никогда'}</div>
-                                    <div><i class="fas fa-folder"></i> <strong>Путь:</strong> ${info.path}</div>
-                                </div>
-                                
-                                <div class="project-actions">
-                                    <button class="btn btn-success btn-sm" onclick="updateProject('${name}')">
-                                        <i class="fas fa-sync-alt"></i> Обновить
-                                    </button>
-                                    <button class="btn btn-info btn-sm" onclick="viewProjectFiles('${name}')">
-                                        <i class="fas fa-folder-open"></i> Файлы
-                                    </button>
-                                    <button class="btn btn-warning btn-sm" onclick="viewProjectLogs('${name}')">
-                                        <i class="fas fa-file-alt"></i> Логи
-                                    </button>
-                                    <button class="btn btn-danger btn-sm" onclick="deleteProject('${name}')">
-                                        <i class="fas fa-trash"></i> Удалить
-                                    </button>
-                                </div>
-                            </div>
-                        `;
-                    }
-                    projectsList.innerHTML = html;
-                })
-                .catch(err => {
-                    document.getElementById('projectsList').innerHTML = `
-                        <div class="alert alert-error">
-                            <i class="fas fa-exclamation-triangle"></i> Ошибка загрузки проектов: ${err.message}
-                        </div>
-                    `;
-                });
-        }
+ASSETS_DIR = os.path.join(app.root_path, "static")
+ASSET_MAX_AGE = 365 * 24 * 3600
+FONT_AWESOME_CSS = "css/all.min.css"
+CSS_WEBFONT_URL = re.compile(r'url\(\.\./webfonts/([^)?#]+)\)')
 
-        // Деплой проекта
-        document.getElementById('deployForm').addEventListener('submit', function(e) {
-            e.preventDefault();
-            
-            const projectName = document.getElementById('projectName').value.trim();
-            const repoUrl = document.getElementById('repoUrl').value.trim();
-            const branch = document.getElementById('branch').value.trim() || 'main';
-            
-            if (!projectName || !repoUrl) {
-                showStatus('❌ Заполните все обязательные поля', 'error');
-                return;
-            }
-            
-            if (!repoUrl.includes('github.com')) {
-                showStatus('❌ Поддерживается только GitHub репозитории', 'error');
-                return;
-            }
-            
-            showStatus('🔄 Деплой начат... Пожалуйста, подождите.', 'info');
-            
-            fetch('/api/deploy', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    project_name: projectName,
-                    repo_url: repoUrl,
-                    branch: branch
-                })
-            })
-            .then(r => r.json())
-            .then(data => {
-                if (data.error) {
-                    showStatus('❌ ' + data.error, 'error');
-                } else {
-                    showStatus('✅ ' + data.message, 'success');
-                    document.getElementById('deployForm').reset();
-                    document.getElementById('branch').value = 'main';
-                    loadProjects();
-                    updateStats();
-                }
-            })
-            .catch(err => showStatus('❌ Ошибка сети: ' + err.message, 'error'));
-        });
+# логическое имя -> ассет; имя с отпечатком -> тот же ассет
+asset_manifest = {}
+asset_files = {}
 
-        // Обновление проекта
-        function updateProject(name) {
-            showStatus(`🔄 Обновление проекта ${name}...`, 'info');
-            
-            fetch(`/api/update/${name}`, { method: 'POST' })
-                .then(r => r.json())
-                .then(data => {
-                    if (data.error) {
-                        showStatus('❌ ' + data.error, 'error');
-                    } else {
-                        showStatus('✅ ' + data.message, 'success');
-                        loadProjects();
-                        updateStats();
-                    }
-                })
-                .catch(err => showStatus('❌ Ошибка: ' + err.message, 'error'));
-        }
+def _register_asset(name, data, mimetype):
+    """Ассет в памяти под именем с отпечатком содержимого: имя меняется вместе с файлом,
+    поэтому браузер может кэшировать его навсегда (immutable)"""
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    stem, ext = os.path.splitext(name)
+    fingerprinted = f"{stem}.{digest}{ext}"
+    asset = {"data": data, "mimetype": mimetype, "etag": digest, "url": f"/assets/{fingerprinted}", "encoded": {}}
+    asset_manifest[name] = asset
+    asset_files[fingerprinted] = asset
 
-        // Удаление проекта
-        function deleteProject(name) {
-            if (!confirm(`Удалить проект "${name}"?\n\nЭто действие нельзя отменить!`)) {
-                return;
-            }
-            
-            showStatus(`🗑️ Удаление проекта ${name}...`, 'info');
-            
-            fetch(`/api/project/${name}`, { method: 'DELETE' })
-                .then(r => r.json())
-                .then(data => {
-                    if (data.error) {
-                        showStatus('❌ ' + data.error, 'error');
-                    } else {
-                        showStatus('✅ ' + data.message, 'success');
-                        loadProjects();
-                        updateStats();
-                    }
-                })
-                .catch(err => showStatus('❌ Ошибка: ' + err.message, 'error'));
-        }
+def _font_awesome_dir():
+    """Локальная копия Font Awesome из пакета fontawesomefree (None - пакет не установлен)"""
+    spec = importlib.util.find_spec("fontawesomefree")
+    if spec is None or not spec.origin:
+        return None
+    path = os.path.join(os.path.dirname(spec.origin), "static", "fontawesomefree")
+    return path if os.path.isdir(path) else None
 
-        // Просмотр файлов проекта
-        function viewProjectFiles(name) {
-            window.open(`/api/project/${name}/files`, '_blank');
-        }
+def build_asset_manifest():
+    """Загрузка ассетов дашборда при старте; шрифты иконок подставляются в CSS по именам с отпечатком"""
+    for filename in sorted(os.listdir(ASSETS_DIR)):
+        with open(os.path.join(ASSETS_DIR, filename), 'rb') as f:
+            _register_asset(filename, f.read(), mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    
+    fa_dir = _font_awesome_dir()
+    if fa_dir is None:
+        logger.warning("⚠️ Пакет fontawesomefree не установлен: иконки загружаются с CDN")
+        return
+    webfonts_dir = os.path.join(fa_dir, "webfonts")
+    for filename in sorted(os.listdir(webfonts_dir)):
+        with open(os.path.join(webfonts_dir, filename), 'rb') as f:
+            _register_asset(f"fa/{filename}", f.read(), mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    
+    with open(os.path.join(fa_dir, FONT_AWESOME_CSS), encoding='utf-8') as f:
+        css = f.read()
+    css = CSS_WEBFONT_URL.sub(
+        lambda m: f"url({asset_manifest[f'fa/{m.group(1)}']['url']})" if f"fa/{m.group(1)}" in asset_manifest else m.group(0),
+        css
+    )
+    _register_asset("fa/icons.css", css.encode('utf-8'), 'text/css')
 
-        // Просмотр логов проекта
-        function viewProjectLogs(name) {
-            window.open(`/api/project/${name}/logs`, '_blank');
-        }
+def asset_url(name):
+    asset = asset_manifest.get(name)
+    return asset["url"] if asset else None
 
-        // Показ статуса
-        function showStatus(message, type) {
-            const statusDiv = document.getElementById('deployStatus');
-            const colors = {
-                'success': 'alert-success',
-                'error': 'alert-error',
-                'info': 'alert-success'
-            };
-            
-            statusDiv.innerHTML = `<div class="alert ${colors[type] || 'alert-success'}">${message}</div>`;
-            
-            setTimeout(() => {
-                statusDiv.innerHTML = '';
-            }, 5000);
-        }
+def asset_response(asset):
+    """Условный ответ со статичным телом; сжатые варианты текстовых ассетов кэшируются в самом ассете"""
+    if asset["mimetype"] not in COMPRESS_MIMETYPES:
+        return conditional_response(asset["etag"], lambda: app.response_class(asset["data"], mimetype=asset["mimetype"]))
+    
+    response = conditional_response(
+        asset["etag"], lambda: precompressed_response(asset["encoded"], asset["data"], asset["mimetype"])
+    )
+    response.vary.add('Accept-Encoding')
+    if 'Content-Encoding' in response.headers:
+        response.set_etag(asset["etag"], weak=True)
+    return response
 
-        // Инициализация
-        document.addEventListener('DOMContentLoaded', function() {
-            loadProjects();
-            updateStats();
-            
-            // Обновление каждые 30 секунд
-            setInterval(() => {
-                updateStats();
-                loadProjects();
-            }, 30000);
-        });
-    </script>
-</body>
-</html>
-    """, projects=projects, stats=system_stats)
+def build_dashboard():
+    """Шаблон компилируется и рендерится один раз при старте: данные страница загружает через API"""
+    html = app.jinja_env.get_template("dashboard.html").render(asset_url=asset_url).encode('utf-8')
+    return {
+        "data": html, "mimetype": "text/html", "etag": make_etag("dashboard", hashlib.sha256(html).hexdigest()),
+        "encoded": {}
+    }
+
+build_asset_manifest()
+dashboard_page = build_dashboard()
+
+@app.route('/')
+def index():
+    logger.info("🏠 Загрузка главной страницы")
+    return asset_response(dashboard_page)
+
+@app.route('/assets/<path:filename>')
+def serve_asset(filename):
+    """Ассеты с отпечатком в имени: кэшируются браузером без перепроверок"""
+    asset = asset_files.get(filename)
+    if not asset:
+        return jsonify({"error": "Файл не найден"}), 404
+    response = asset_response(asset)
+    response.headers['Cache-Control'] = f'public, max-age={ASSET_MAX_AGE}, immutable'
+    return response
 
 @app.route('/api/stats')
 def api_stats():
-    """API статистики"""
-    config = load_config()
-    uptime = datetime.now() - system_stats["start_time"]
-    
-    total_size = 0
-    total_files = 0
+    """API статистики (ETag по версии проектов и счётчикам)"""
+    system_stats = get_system_stats()
+    etag = make_etag(
+        "stats", get_state_version(), system_stats["start_time"],
+        system_stats["deploys"], system_stats["updates"], system_stats["errors"]
+    )
     
-    for project in config.get('projects', {}).values():
-        if project.get('path') and os.path.exists(project['path']):
-            info = get_project_info(project['path'])
-            total_size += info['size_mb']
-            total_files += info['files_count']
+    def build():
+        uptime = datetime.now() - system_stats["start_time"]
+        
+        totals = get_projects_totals()
+        total_size = totals["total_size"]
+        total_files = totals["total_files"]
+        
+        return jsonify({
+            "projects": totals["projects"],
+            "deploys": system_stats["deploys"],
+            "updates": system_stats["updates"],
+            "errors": system_stats["errors"],
+            "uptime": str(uptime).split('.')[0],
+            "started_at": system_stats["start_time"].isoformat(),
+            "total_size_mb": round(total_size, 1),
+            "total_files": total_files,
+            "flask_port": FLASK_PORT,
+            "timestamp": datetime.now().isoformat()
+        })
     
-    return jsonify({
-        "projects": len(config.get('projects', {})),
-        "deploys": system_stats["deploys"],
-        "updates": system_stats["updates"],
-        "errors": system_stats["errors"],
-        "uptime": str(uptime).split('.')[0],
-        "total_size_mb": round(total_size, 1),
-        "total_files": total_files,
-        "flask_port": FLASK_PORT,
-        "timestamp": datetime.now().isoformat()
-    })
+    return conditional_response(etag, build)
 
 @app.route('/api/deploy', methods=['POST'])
 def api_deploy():
-    """API деплоя проектов"""
+    """API деплоя проектов (задача ставится в очередь)"""
     try:
         data = request.json
         repo_url = data.get('repo_url')
@@ -1216,142 +3391,151 @@ def api_deploy():
         if not repo_url or not project_name:
             return jsonify({"error": "Не указаны repo_url и project_name"}), 400
         
-        if "github.com" not in repo_url:
-            return jsonify({"error": "Поддерживается только GitHub"}), 400
+        if not normalize_repo_key(repo_url):
+            return jsonify({"error": "Поддерживается только GitHub репозиторий вида https://github.com/owner/repo"}), 400
         
-        # Проверка на существование проекта
-        config = load_config()
-        projects = config.get('projects', {})
+        # Тот же репозиторий и ветка уже развёрнуты под другим именем
+        duplicates = [
+            name for name, project in find_projects_by_repo(repo_url).items()
+            if name != project_name and project.get('branch', 'main') == branch
+        ]
         
-        project_path = os.path.join(PROJECTS_DIR, project_name)
-        
-        if project_name in projects:
-            log_action(f"API: Обновление существующего проекта {project_name}")
-            action = "обновлен"
-        else:
-            log_action(f"API: Создание нового проекта {project_name}")
-            action = "создан"
-        
-        # Скачивание репозитория
-        if not os.path.exists(project_path):
-            os.makedirs(project_path, exist_ok=True)
-        
-        download_repo_from_github(repo_url, branch, project_path)
-        
-        # Установка зависимостей
-        success, deps_msg = install_requirements(project_path, project_name)
-        
-        # Сохранение конфигурации
-        config['projects'][project_name] = {
-            'repo_url': repo_url,
-            'branch': branch,
-            'path': project_path,
-            'created': datetime.now().strftime("%Y-%m-%d %H:%M:%S") if action == "создан" else projects.get(project_name, {}).get('created'),
-            'last_update': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            'deploy_count': projects.get(project_name, {}).get('deploy_count', 0) + 1
-        }
-        save_config(config)
-        
-        log_action(f"API: Проект {project_name} успешно {action}")
+        job = job_queue.submit("deploy", {
+            "project_name": project_name,
+            "repo_url": repo_url,
+            "branch": branch,
+            "force": bool(data.get('force'))
+        }, project=project_name)
         
         return jsonify({
-            "status": "success",
-            "action": action,
+            "status": "queued",
+            "job_id": job.id,
             "project": project_name,
-            "message": f"Проект {project_name} успешно {action}!",
-            "dependencies": deps_msg,
-            "path": project_path,
-            "info": get_project_info(project_path)
-        })
+            "message": f"Деплой {project_name} поставлен в очередь",
+            "status_url": f"/api/jobs/{job.id}",
+            "same_repo_projects": duplicates
+        }), 202
     
     except Exception as e:
-        system_stats["errors"] += 1
+        count_event("errors")
         log_action(f"API: ОШИБКА деплоя: {str(e)}", "ERROR")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/projects')
 def api_projects():
-    """API списка проектов"""
+    """API списка проектов (ETag по версии состояния проектов).
+    Без параметров - словарь всех проектов; с параметрами fields, sort, limit/cursor, branch,
+    max_age_hours/min_age_hours - страница {"projects": [...], "next_cursor": ...}"""
     try:
-        config = load_config()
-        projects = config.get('projects', {})
-        
-        # Добавляем дополнительную информацию к каждому проекту
-        enhanced_projects = {}
-        for name, project in projects.items():
-            enhanced_projects[name] = {
-                **project,
-                **get_project_info(project.get('path', ''))
-            }
+        def build():
+            if not request.args:
+                return jsonify(aggregate_cache.get("projects_enhanced", collect_enhanced_projects))
+            
+            fields = request.args.get('fields')
+            limit = request.args.get('limit', type=int)
+            try:
+                projects, next_cursor, total = query_projects(
+                    fields=set(filter(None, fields.split(','))) if fields else None,
+                    sort=request.args.get('sort', 'name'),
+                    branch=request.args.get('branch') or None,
+                    max_age_hours=request.args.get('max_age_hours', type=float),
+                    min_age_hours=request.args.get('min_age_hours', type=float),
+                    limit=max(1, min(limit or PROJECTS_PAGE_LIMIT, PROJECTS_PAGE_MAX)),
+                    cursor=request.args.get('cursor') or None
+                )
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            
+            return jsonify({"projects": projects, "count": len(projects), "total": total, "next_cursor": next_cursor})
         
-        return jsonify(enhanced_projects)
+        # Фильтры по давности обновления зависят от текущего времени: ETag меняется раз в минуту
+        time_bucket = int(time.time() // 60) if 'max_age_hours' in request.args or 'min_age_hours' in request.args else None
+        etag = make_etag("projects", get_state_version(), request.query_string, time_bucket)
+        return conditional_response(etag, build)
     except Exception as e:
         return jsonify({"error": str(e)})
 
 @app.route('/api/update/<name>', methods=['POST'])
 def api_update_project(name):
-    """API обновления проекта"""
+    """API обновления проекта (задача ставится в очередь)"""
     try:
-        config = load_config()
-        projects = config.get('projects', {})
-        
-        if name not in projects:
+        if not get_project_record(name):
             return jsonify({"error": "Проект не найден"}), 404
         
-        project = projects[name]
-        
-        log_action(f"API: Начато обновление проекта {name}")
-        
-        # Скачивание обновлений
-        download_repo_from_github(project['repo_url'], project['branch'], project['path'])
-        
-        # Установка зависимостей
-        success, deps_msg = install_requirements(project['path'], name)
-        
-        # Обновление конфигурации
-        config['projects'][name]['last_update'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        config['projects'][name]['update_count'] = config['projects'][name].get('update_count', 0) + 1
-        save_config(config)
-        
-        system_stats["updates"] += 1
-        log_action(f"API: Проект {name} успешно обновлен")
+        data = request.get_json(silent=True) or {}
+        force = str(request.args.get('force', data.get('force', ''))).lower() in ('1', 'true', 'yes')
+        job = job_queue.submit("update", {"source": "API", "force": force}, project=name)
         
         return jsonify({
-            "status": "success",
+            "status": "queued",
+            "job_id": job.id,
             "project": name,
-            "message": f"Проект {name} обновлен!",
-            "dependencies": deps_msg,
-            "info": get_project_info(project['path'])
-        })
+            "message": f"Обновление {name} поставлено в очередь",
+            "status_url": f"/api/jobs/{job.id}"
+        }), 202
     
     except Exception as e:
-        system_stats["errors"] += 1
-        log_action(f"API: ОШИБКА обновления {name}: {str(e)}", "ERROR")
+        count_event("errors", project=name)
+        log_action(f"API: ОШИБКА обновления {name}: {str(e)}", "ERROR", project=name)
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/jobs')
+def api_jobs():
+    """API списка последних задач деплоя"""
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({"jobs": job_queue.list(limit)})
+
+@app.route('/api/jobs/<job_id>')
+def api_job_status(job_id):
+    """API статуса задачи деплоя"""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({"error": "Задача не найдена"}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def api_cancel_job(job_id):
+    """API отмены задачи деплоя"""
+    if not job_queue.get(job_id):
+        return jsonify({"error": "Задача не найдена"}), 404
+    if not job_queue.cancel(job_id):
+        return jsonify({"error": "Задача уже завершена"}), 409
+    return jsonify({"status": "cancelling", "job": job_queue.get(job_id)})
+
 @app.route('/api/project/<name>', methods=['DELETE'])
 def api_delete_project(name):
     """API удаления проекта"""
     try:
-        config = load_config()
-        projects = config.get('projects', {})
+        project = get_project_record(name)
         
-        if name not in projects:
+        if not project:
             return jsonify({"error": "Проект не найден"}), 404
         
-        project_path = projects[name]['path']
-        
-        log_action(f"API: Удаление проекта {name}")
+        project_path = project['path']
         
-        # Удаление директории
-        if os.path.exists(project_path):
-            shutil.rmtree(project_path)
+        log_action(f"API: Удаление проекта {name}", project=name)
         
-        # Удаление из конфигурации
-        del config['projects'][name]
-        save_config(config)
+        # Задачи проекта отменяются и дожидаются: иначе выполняемый деплой восстановил бы файлы и запись
+        cancelled = job_queue.cancel_project(name)
+        if cancelled and not job_queue.wait_project_idle(name, JOB_CANCEL_WAIT_SECONDS):
+            return jsonify({
+                "error": "Задачи проекта ещё выполняются, повторите удаление позже",
+                "jobs": cancelled
+            }), 409
+        
+        with project_lock(os.path.basename(os.path.normpath(project_path))):
+            # Удаление директории
+            if os.path.exists(project_path):
+                shutil.rmtree(project_path)
+            for state_path in (get_manifest_path(project_path), get_deploy_state_path(project_path)):
+                if os.path.exists(state_path):
+                    os.remove(state_path)
+            shutil.rmtree(get_project_venv_dir(name), ignore_errors=True)
+            
+            # Удаление из хранилища
+            delete_project_record(name)
         
-        log_action(f"API: Проект {name} успешно удален")
+        log_action(f"API: Проект {name} успешно удален", project=name)
         
         return jsonify({
             "status": "success",
@@ -1360,49 +3544,160 @@ def api_delete_project(name):
         })
     
     except Exception as e:
-        log_action(f"API: ОШИБКА удаления {name}: {str(e)}", "ERROR")
+        log_action(f"API: ОШИБКА удаления {name}: {str(e)}", "ERROR", project=name)
         return jsonify({"error": str(e)}), 500
 
+FILE_FIELDS = ("name", "path", "size", "size_human", "modified", "type")
+
+def _scan_sorted(dir_path):
+    """Записи одного каталога по имени (DirEntry; stat не вызывается)"""
+    try:
+        with os.scandir(dir_path) as entries:
+            return sorted(entries, key=lambda entry: entry.name)
+    except OSError:
+        return []
+
+def iter_project_entries(base_dir, rel_dir="", recursive=True, after=None):
+    """Обход каталога в порядке путей (имена по возрастанию, вглубь) с продолжением после пути after;
+    в памяти - только записи текущей ветки каталогов. after - путь от корня проекта внутри rel_dir
+    (иначе ValueError)"""
+    if after and rel_dir:
+        if not after.startswith(rel_dir + '/'):
+            raise ValueError(f"Курсор {after} вне каталога {rel_dir}")
+        after = after[len(rel_dir) + 1:]
+    after_parts = after.split('/') if after else []
+    
+    def walk(rel_dir, after_parts):
+        resume = after_parts[0] if after_parts else None
+        for entry in _scan_sorted(os.path.join(base_dir, rel_dir)):
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if resume is not None:
+                if entry.name < resume:
+                    continue
+                if entry.name == resume:
+                    if recursive and is_dir and len(after_parts) > 1:
+                        yield from walk(rel_path, after_parts[1:])
+                    continue
+            
+            if is_dir and recursive:
+                yield from walk(rel_path, [])
+            else:
+                yield entry, rel_path, is_dir
+    
+    return walk(rel_dir, after_parts)
+
+def _file_entry(entry, rel_path, is_dir, fields):
+    """Описание файла только с запрошенными полями (stat - только если нужны размер или дата)"""
+    item = {}
+    if "name" in fields:
+        item["name"] = entry.name
+    if "path" in fields:
+        item["path"] = rel_path
+    if "type" in fields:
+        item["type"] = "dir" if is_dir else (entry.name.split('.')[-1] if '.' in entry.name else 'unknown')
+    
+    if not is_dir and fields & {"size", "size_human", "modified"}:
+        try:
+            entry_stat = entry.stat(follow_symlinks=False)
+        except OSError:
+            return item
+        file_size = entry_stat.st_size
+        if "size" in fields:
+            item["size"] = file_size
+        if "size_human" in fields:
+            item["size_human"] = f"{file_size / 1024:.1f} KB" if file_size > 1024 else f"{file_size} B"
+        if "modified" in fields:
+            item["modified"] = datetime.fromtimestamp(entry_stat.st_mtime).strftime("%Y-%m-%d %H:%M:%S")
+    return item
+
 @app.route('/api/project/<name>/files')
 def api_project_files(name):
-    """API просмотра файлов проекта"""
+    """API просмотра файлов проекта: страницы по cursor, каталог dir (recursive=0 - только его записи),
+    фильтры glob/ext, выбор полей fields, потоковый NDJSON (format=ndjson)"""
     try:
-        config = load_config()
-        projects = config.get('projects', {})
+        project = get_project_record(name)
         
-        if name not in projects:
+        if not project:
             return jsonify({"error": "Проект не найден"}), 404
         
-        project_path = projects[name]['path']
+        project_path = project['path']
         
         if not os.path.exists(project_path):
             return jsonify({"error": "Директория проекта не найдена"}), 404
         
+        rel_dir = request.args.get('dir', '').strip('/')
+        if rel_dir:
+            dir_path = os.path.realpath(os.path.join(project_path, rel_dir))
+            if not dir_path.startswith(os.path.realpath(project_path) + os.sep) or not os.path.isdir(dir_path):
+                return jsonify({"error": "Каталог не найден"}), 404
+        
+        recursive = request.args.get('recursive', '1') not in ('0', 'false', 'no')
+        cursor = request.args.get('cursor') or None
+        if cursor and rel_dir and not cursor.startswith(rel_dir + '/'):
+            return jsonify({"error": "Курсор не относится к каталогу dir"}), 400
+        pattern = request.args.get('glob')
+        extensions = {
+            ext.strip().lower().lstrip('.') for ext in request.args.get('ext', '').split(',') if ext.strip()
+        }
+        fields = set(filter(None, request.args.get('fields', '').split(','))) & set(FILE_FIELDS) or set(FILE_FIELDS)
+        
+        ndjson = request.args.get('format') == 'ndjson'
+        limit = request.args.get('limit', type=int)
+        if not ndjson or limit:
+            limit = max(1, min(limit or FILES_PAGE_LIMIT, FILES_PAGE_MAX))
+        
+        def matches(entry, rel_path, is_dir):
+            if is_dir:
+                return True
+            if extensions and entry.name.rsplit('.', 1)[-1].lower() not in extensions:
+                return False
+            if pattern and not fnmatch.fnmatch(rel_path if '/' in pattern else entry.name, pattern):
+                return False
+            return True
+        
+        def page():
+            """Подходящие записи страницы; последний элемент - курсор следующей страницы"""
+            count = 0
+            last_path = None
+            for entry, rel_path, is_dir in iter_project_entries(project_path, rel_dir, recursive, cursor):
+                if not matches(entry, rel_path, is_dir):
+                    continue
+                if limit and count == limit:
+                    yield None, last_path
+                    return
+                count += 1
+                last_path = rel_path
+                yield _file_entry(entry, rel_path, is_dir, fields), None
+            yield None, None
+        
+        if ndjson:
+            def stream():
+                count = 0
+                for item, next_cursor in page():
+                    if item is None:
+                        yield json.dumps({"next_cursor": next_cursor, "count": count}) + "\n"
+                        return
+                    count += 1
+                    yield json.dumps(item, ensure_ascii=False) + "\n"
+            
+            return Response(stream(), mimetype='application/x-ndjson')
+        
         files = []
-        for root, dirs, filenames in os.walk(project_path):
-            for filename in filenames:
-                file_path = os.path.join(root, filename)
-                rel_path = os.path.relpath(file_path, project_path)
-                file_size = os.path.getsize(file_path)
-                file_mtime = datetime.fromtimestamp(os.path.getmtime(file_path))
-                
-                files.append({
-                    "name": filename,
-                    "path": rel_path,
-                    "size": file_size,
-                    "size_human": f"{file_size / 1024:.1f} KB" if file_size > 1024 else f"{file_size} B",
-                    "modified": file_mtime.strftime("%Y-%m-%d %H:%M:%S"),
-                    "type": filename.split('.')[-1] if '.' in filename else 'unknown'
-                })
-        
-        # Сортировка по имени
-        files.sort(key=lambda x: x['name'])
+        next_cursor = None
+        for item, page_cursor in page():
+            if item is None:
+                next_cursor = page_cursor
+                break
+            files.append(item)
         
         return jsonify({
             "project": name,
+            "dir": rel_dir,
             "files": files,
-            "total_files": len(files),
-            "total_size": sum(f['size'] for f in files)
+            "count": len(files),
+            "total_size": sum(f.get('size', 0) for f in files),
+            "next_cursor": next_cursor
         })
     
     except Exception as e:
@@ -1412,24 +3707,20 @@ def api_project_files(name):
 def api_project_logs(name):
     """API логов проекта"""
     try:
-        config = load_config()
-        projects = config.get('projects', {})
-        
-        if name not in projects:
+        if not get_project_record(name):
             return "Проект не найден", 404
         
-        # Фильтрация логов по названию проекта
-        if os.path.exists(LOG_FILE):
-            with open(LOG_FILE, 'r', encoding='utf-8') as f:
-                all_logs = f.read()
-            
-            # Выбираем только логи, связанные с этим проектом
-            project_logs = []
-            for line in all_logs.split('\n'):
-                if name in line:
-                    project_logs.append(line)
-            
-            return '\n'.join(project_logs[-100:]), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+        limit = request.args.get('limit', 100, type=int)
+        since = parse_time_param(request.args.get('since'))
+        until = parse_time_param(request.args.get('until'))
+        records = read_project_logs(name, limit=limit, since=since, until=until)
+        
+        if request.args.get('format') == 'json':
+            return jsonify({"project": name, "records": records, "count": len(records)})
+        
+        if records:
+            project_logs = [f"[{record['time']}] [{record['level']}] {record['message']}" for record in records]
+            return '\n'.join(project_logs), 200, {'Content-Type': 'text/plain; charset=utf-8'}
         
         return f"Логи для проекта {name} не найдены", 200, {'Content-Type': 'text/plain; charset=utf-8'}
     
@@ -1439,7 +3730,7 @@ def api_project_logs(name):
 @app.route('/health')
 def health():
     """API проверки здоровья системы"""
-    config = load_config()
+    system_stats = get_system_stats()
     uptime = datetime.now() - system_stats["start_time"]
     
     return jsonify({
@@ -1450,10 +3741,11 @@ def health():
         "flask_running": flask_running,
         "flask_port": FLASK_PORT,
         "flask_host": FLASK_HOST,
-        "projects_count": len(config.get('projects', {})),
+        "projects_count": count_project_records(),
         "system_stats": system_stats,
         "timestamp": datetime.now().isoformat(),
         "bot_active": True,
+        "bot_latency": get_bot_latency_summary(),
         "features": [
             "GitHub Integration",
             "Telegram Bot",
@@ -1470,75 +3762,140 @@ def health():
         }
     })
 
+@app.route('/api/counters')
+def api_counters():
+    """Накопительные счётчики: итоги и разбивка по проектам"""
+    totals = {key: value for key, value in counter_store.snapshot().items() if not key.startswith("project:")}
+    return jsonify({"totals": totals, "projects": get_project_counters()})
+
+@app.route('/metrics')
+def metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return render_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 @app.route('/api/logs')
 def api_logs():
-    """API системных логов"""
+    """API системных логов (последние строки, постранично назад через cursor)"""
     try:
-        if os.path.exists(LOG_FILE):
-            with open(LOG_FILE, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # Последние 1000 строк или 50KB
-            lines = content.split('\n')[-1000:]
-            recent_logs = '\n'.join(lines)
-            
-            if len(recent_logs) > 50000:
-                recent_logs = recent_logs[-50000:]
-            
-            return recent_logs, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+        max_lines = min(request.args.get('lines', 1000, type=int), 10000)
+        max_bytes = min(request.args.get('max_bytes', 50000, type=int), 1000000)
+        try:
+            lines, next_cursor = read_log_page(max_lines, request.args.get('cursor'), max_bytes)
+        except ValueError as e:
+            return str(e), 400, {'Content-Type': 'text/plain; charset=utf-8'}
         
-        return "Системные логи пусты", 200, {'Content-Type': 'text/plain; charset=utf-8'}
+        if request.args.get('format') == 'json':
+            return jsonify({"lines": lines, "count": len(lines), "next_cursor": next_cursor})
+        
+        headers = {'Content-Type': 'text/plain; charset=utf-8'}
+        if next_cursor:
+            headers['X-Next-Cursor'] = next_cursor
+        
+        if lines:
+            return '\n'.join(lines), 200, headers
+        
+        return "Системные логи пусты", 200, headers
     except Exception as e:
         return f"Ошибка чтения логов: {str(e)}", 500, {'Content-Type': 'text/plain; charset=utf-8'}
 
+@app.route('/api/events')
+def api_events():
+    """SSE-поток: этапы и прогресс задач, вывод pip, записи журнала"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id', '')
+    project_filter = request.args.get('project')
+    type_filter = set(filter(None, request.args.get('types', '').split(',')))
+    after_id = int(last_event_id) if last_event_id.isdigit() else event_bus.last_id
+    
+    def stream(after_id):
+        # Соединение периодически закрывается: браузер переподключится с Last-Event-ID,
+        # а воркеры HTTP-сервера не держат подписчиков бесконечно при перезапуске
+        closes_at = time.monotonic() + SSE_MAX_CONNECTION_SECONDS
+        yield "retry: 3000\n\n"
+        while time.monotonic() < closes_at:
+            events = event_bus.wait(after_id, SSE_HEARTBEAT_SECONDS)
+            if not events:
+                yield ": ping\n\n"
+                continue
+            for event_id, event_type, data in events:
+                after_id = event_id
+                if type_filter and event_type not in type_filter:
+                    continue
+                if project_filter and data.get("project") != project_filter:
+                    continue
+                yield f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    
+    return Response(stream(after_id), mimetype='text/event-stream', headers={'X-Accel-Buffering': 'no'})
+
 @app.route('/webhook', methods=['POST'])
 def webhook():
-    """GitHub webhook обработчик"""
+    """GitHub webhook обработчик: ответ сразу, деплой - через очередь с объединением пушей"""
+    registered_delivery = None
     try:
-        data = request.json
+        event_type = request.headers.get('X-GitHub-Event', 'push')
+        if event_type == 'ping':
+            return jsonify({"status": "pong"})
+        if event_type != 'push':
+            return jsonify({"status": "ignored", "reason": f"событие {event_type} не обрабатывается"}), 202
+        
+        data = request.get_json(silent=True)
         
         if not data:
             return jsonify({"error": "Пустые данные"}), 400
         
+        delivery_id = request.headers.get('X-GitHub-Delivery')
+        if delivery_id:
+            if not register_webhook_delivery(delivery_id):
+                return jsonify({"status": "duplicate", "delivery": delivery_id}), 202
+            registered_delivery = delivery_id
+        
         # Получаем URL репозитория
         repo_url = data.get('repository', {}).get('clone_url') or data.get('repository', {}).get('html_url')
         
         if not repo_url:
             return jsonify({"error": "URL репозитория не найден"}), 400
         
-        # Ищем соответствующий проект
-        config = load_config()
-        updated_projects = []
+        ref = data.get('ref', '')
+        if not ref.startswith('refs/heads/') or data.get('deleted'):
+            return jsonify({"status": "ignored", "reason": f"не пуш в ветку: {ref}"}), 202
+        pushed_branch = ref[len('refs/heads/'):]
         
-        for name, project in config['projects'].items():
-            if project['repo_url'] in repo_url or repo_url in project['repo_url']:
-                try:
-                    log_action(f"Webhook: автообновление {name}")
-                    download_repo_from_github(project['repo_url'], project['branch'], project['path'])
-                    install_requirements(project['path'], name)
-                    
-                    config['projects'][name]['last_update'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    config['projects'][name]['webhook_updates'] = config['projects'][name].get('webhook_updates', 0) + 1
-                    
-                    updated_projects.append(name)
-                    log_action(f"Webhook: {name} успешно обновлен")
-                    
-                except Exception as e:
-                    log_action(f"Webhook: ошибка обновления {name}: {str(e)}", "ERROR")
+        # Проекты этого репозитория по индексу; деплоятся только настроенные на запушенную ветку
+        queued_jobs = {}
+        repo_projects = find_projects_by_repo(repo_url)
         
-        save_config(config)
+        for name, project in repo_projects.items():
+            if project.get('branch', 'main') != pushed_branch:
+                continue
+            
+            # Пуши в пределах окна объединяются в один деплой свежего коммита
+            job = job_queue.submit(
+                "update",
+                {"source": "Webhook", "commit": data.get('after'), "delivery": delivery_id},
+                project=name,
+                delay=WEBHOOK_DEBOUNCE_SECONDS,
+                coalesce_key=f"webhook:{name}"
+            )
+            queued_jobs[name] = job.id
         
-        if updated_projects:
+        if queued_jobs:
             return jsonify({
-                "status": "success", 
-                "updated_projects": updated_projects,
-                "message": f"Обновлено проектов: {len(updated_projects)}"
-            })
+                "status": "queued",
+                "updated_projects": list(queued_jobs),
+                "jobs": queued_jobs,
+                "message": f"Поставлено в очередь проектов: {len(queued_jobs)}"
+            }), 202
+        elif repo_projects:
+            return jsonify({"status": "ignored", "reason": f"нет проектов на ветке {pushed_branch}"}), 202
         else:
             return jsonify({"status": "no_matching_projects"}), 404
     
     except Exception as e:
         log_action(f"Webhook: ОШИБКА: {str(e)}", "ERROR")
+        if registered_delivery:
+            try:
+                forget_webhook_delivery(registered_delivery)
+            except Exception as forget_error:
+                logger.error(f"Не удалось отменить регистрацию доставки {registered_delivery}: {forget_error}")
         return jsonify({"error": str(e)}), 500
 
 # Добавляем обработчики для остальных Telegram команд...
@@ -1582,8 +3939,7 @@ async def handle_deploy_steps(message: types.Message):
                 return
             
             # Проверка на существование
-            config = load_config()
-            if project_name in config.get('projects', {}):
+            if get_project_record(project_name):
                 await message.answer(f"❌ Проект '{project_name}' уже существует")
                 return
             
@@ -1604,17 +3960,25 @@ async def handle_deploy_steps(message: types.Message):
         elif state["step"] == "url":
             repo_url = message.text.strip()
             
-            if "github.com" not in repo_url:
+            if not normalize_repo_key(repo_url):
                 await message.answer("❌ Поддерживается только GitHub репозитории")
                 return
             
             state["repo_url"] = repo_url
             state["step"] = "branch"
             
+            existing = find_projects_by_repo(repo_url)
+            existing_text = ""
+            if existing:
+                existing_text = "⚠️ Этот репозиторий уже развёрнут: " + ", ".join(
+                    f"<code>{name}</code> ({project.get('branch', 'main')})" for name, project in existing.items()
+                ) + "\n\n"
+            
             await message.answer(
                 f"🌿 <b>Деплой проекта</b>\n\n"
                 f"✅ Название: <code>{state['project_name']}</code>\n"
                 f"✅ Репозиторий: GitHub\n\n"
+                f"{existing_text}"
                 f"Шаг 3/3: Введите ветку или выберите main",
                 parse_mode="HTML",
                 reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
@@ -1659,26 +4023,25 @@ async def start_deploy(message, state):
         os.makedirs(project_path, exist_ok=True)
         
         # Скачивание репозитория
-        log_action(f"Bot: Начат деплой {project_name}")
-        download_repo_from_github(repo_url, branch, project_path)
+        log_action(f"Bot: Начат деплой {project_name}", project=project_name)
+        await run_blocking(download_repo_from_github, repo_url, branch, project_path)
         
         # Установка зависимостей
-        success, deps_msg = install_requirements(project_path, project_name)
+        success, deps_msg = await run_blocking(install_requirements, project_path, project_name)
         
         # Получение информации о проекте
-        project_info = get_project_info(project_path)
+        project_info = await run_blocking(get_project_info, project_path)
         
-        # Сохранение конфигурации
-        config = load_config()
-        config['projects'][project_name] = {
+        # Сохранение проекта
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        save_project_record(project_name, {
             'repo_url': repo_url,
             'branch': branch,
             'path': project_path,
-            'created': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            'last_update': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'created': now,
+            'last_update': now,
             'deploy_count': 1
-        }
-        save_config(config)
+        })
         
         # Очистка состояния
         del user_states[message.from_user.id]
@@ -1701,11 +4064,11 @@ async def start_deploy(message, state):
             ]])
         )
         
-        log_action(f"Bot: Проект {project_name} успешно задеплоен")
+        log_action(f"Bot: Проект {project_name} успешно задеплоен", project=project_name)
         
     except Exception as e:
-        system_stats["errors"] += 1
-        log_action(f"Bot: ОШИБКА деплоя {project_name}: {str(e)}", "ERROR")
+        count_event("errors", project=project_name)
+        log_action(f"Bot: ОШИБКА деплоя {project_name}: {str(e)}", "ERROR", project=project_name)
         
         if message.from_user.id in user_states:
             del user_states[message.from_user.id]
@@ -1745,8 +4108,38 @@ def run_flask():
         logger.error(f"КРИТИЧЕСКАЯ ошибка Flask: {e}")
         flask_running = False
 
+def start_gunicorn():
+    """gunicorn отдельным процессом: WEB_WORKERS процессов по WEB_THREADS потоков
+    (gthread - долгие SSE-подключения занимают поток, а не весь воркер)"""
+    command = [
+        sys.executable, '-m', 'gunicorn', 'app:app',
+        '--chdir', os.path.dirname(os.path.abspath(__file__)),
+        '--bind', f'{FLASK_HOST}:{FLASK_PORT}',
+        '--workers', str(WEB_WORKERS),
+        '--worker-class', 'gthread',
+        '--threads', str(WEB_THREADS),
+        '--timeout', str(WEB_TIMEOUT),
+        '--graceful-timeout', str(WEB_GRACEFUL_TIMEOUT),
+        '--keep-alive', str(WEB_KEEPALIVE)
+    ]
+    logger.info(f"🌐 Запуск gunicorn на {FLASK_HOST}:{FLASK_PORT}: {WEB_WORKERS} воркеров × {WEB_THREADS} потоков")
+    return subprocess.Popen(command, env={**os.environ, 'DEPLOY_WEB_WORKER': '1'})
+
+def stop_gunicorn(process):
+    process.terminate()
+    try:
+        process.wait(WEB_GRACEFUL_TIMEOUT + 5)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
 async def main():
+    global bot_process
+    web_process = None
+    lag_monitor = None
     try:
+        bot_process = True
+        mark_service_started()
         log_action("🚀 Deploy Manager Pro v4.0 - ПОЛНАЯ ВЕРСИЯ запущена")
         
         logger.info(f"🔧 Конфигурация:")
@@ -1755,9 +4148,24 @@ async def main():
         logger.info(f"   Логи: {LOG_FILE}")
         logger.info(f"   BotHost План: {os.getenv('BOTHOST_USER_PLAN', 'unknown')}")
         
-        # Запуск Flask сервера
-        flask_thread = threading.Thread(target=run_flask, daemon=True)
-        flask_thread.start()
+        # Подготовка пула виртуальных окружений
+        if PROJECT_VENVS:
+            cleanup_stale_venv_temps()
+        if PROJECT_VENVS and VENV_POOL_SIZE > 0:
+            threading.Thread(target=refill_venv_pool, daemon=True).start()
+        
+        # Запуск очереди деплоев
+        job_queue.load()
+        job_queue.start()
+        
+        # Запуск HTTP-сервера
+        if HTTP_SERVER == 'gunicorn' and importlib.util.find_spec('gunicorn'):
+            web_process = start_gunicorn()
+        else:
+            if HTTP_SERVER == 'gunicorn':
+                logger.error("gunicorn не установлен, используется встроенный сервер Flask")
+            flask_thread = threading.Thread(target=run_flask, daemon=True)
+            flask_thread.start()
         
         # Ожидание запуска Flask
         await asyncio.sleep(4)
@@ -1774,6 +4182,7 @@ async def main():
             logger.warning(f"⚠️ Тест веб-панели не удался: {e}")
         
         # Запуск Telegram бота
+        lag_monitor = asyncio.create_task(monitor_event_loop_lag())
         log_action("🤖 Telegram Bot запущен - ПОЛНАЯ ВЕРСИЯ")
         logger.info("🎉 DEPLOY MANAGER PRO v4.0 ГОТОВ К РАБОТЕ!")
         logger.info("🌐 Веб-панель: https://server.bothost.ru")
@@ -1784,6 +4193,16 @@ async def main():
     except Exception as e:
         logger.error(f"Критическая ошибка запуска: {e}")
         raise
+    finally:
+        if lag_monitor:
+            lag_monitor.cancel()
+            try:
+                await lag_monitor
+            except asyncio.CancelledError:
+                pass
+        await asyncio.get_running_loop().run_in_executor(None, job_queue.shutdown)
+        if web_process:
+            await asyncio.get_running_loop().run_in_executor(None, stop_gunicorn, web_process)
 
 if __name__ == '__main__':
     asyncio.run(main())
@@ -0,0 +1,316 @@
+        // Обновление статистики в реальном времени
+        let startedAt = null;
+
+        function updateStats() {
+            fetch('/api/stats')
+                .then(r => r.json())
+                .then(data => {
+                    document.getElementById('projectsCount').textContent = data.projects || 0;
+                    document.getElementById('deploysCount').textContent = data.deploys || 0;
+                    document.getElementById('updatesCount').textContent = data.updates || 0;
+                    startedAt = data.started_at ? new Date(data.started_at) : null;
+                    renderUptime();
+                })
+                .catch(err => console.log('Ошибка загрузки статистики:', err));
+        }
+
+        // Аптайм считается в браузере: ответ /api/stats не меняется каждую секунду и отдаётся как 304
+        function renderUptime() {
+            if (!startedAt) {
+                document.getElementById('uptime').textContent = 'Online';
+                return;
+            }
+            const seconds = Math.max(0, Math.floor((Date.now() - startedAt) / 1000));
+            const days = Math.floor(seconds / 86400);
+            const time = [Math.floor(seconds % 86400 / 3600), Math.floor(seconds % 3600 / 60), seconds % 60]
+                .map((part, index) => index ? String(part).padStart(2, '0') : part).join(':');
+            document.getElementById('uptime').textContent = days ? `${days} d, ${time}` : time;
+        }
+
+        // Загрузка проектов
+        // Все страницы списка проектов; карточкам не нужны вычисляемые поля (размер, число файлов)
+        function fetchProjects(cursor, collected = []) {
+            const params = new URLSearchParams({fields: 'repo_url,branch,last_update,path', limit: 500});
+            if (cursor) params.set('cursor', cursor);
+            return fetch('/api/projects?' + params)
+                .then(r => r.json())
+                .then(page => {
+                    collected.push(...page.projects);
+                    return page.next_cursor ? fetchProjects(page.next_cursor, collected) : collected;
+                });
+        }
+
+        function loadProjects() {
+            fetchProjects()
+                .then(projects => {
+                    const projectsList = document.getElementById('projectsList');
+
+                    if (projects.length === 0) {
+                        projectsList.innerHTML = `
+                            <div class="project-card">
+                                <div style="text-align: center; padding: 2rem;">
+                                    <i class="fas fa-inbox" style="font-size: 3rem; color: #ddd; margin-bottom: 1rem;"></i>
+                                    <h3>Пока нет проектов</h3>
+                                    <p>Используйте форму выше для деплоя первого проекта</p>
+                                </div>
+                            </div>
+                        `;
+                        return;
+                    }
+
+                    let html = '';
+                    for (const info of projects) {
+                        const name = info.name;
+                        html += `
+                            <div class="project-card">
+                                <div class="project-header">
+                                    <div class="project-title">
+                                        <i class="fas fa-folder"></i> ${name}
+                                    </div>
+                                    <div class="project-status status-active">
+                                        <i class="fas fa-check-circle"></i> Активен
+                                    </div>
+                                </div>
+
+                                <div class="project-info">
+                                    <div><i class="fab fa-github"></i> <strong>Репозиторий:</strong> ${info.repo_url}</div>
+                                    <div><i class="fas fa-code-branch"></i> <strong>Ветка:</strong> ${info.branch}</div>
+                                    <div><i class="fas fa-clock"></i> <strong>Обновлено:</strong> ${info.last_update || 'Никогда'}</div>
+                                    <div><i class="fas fa-folder"></i> <strong>Путь:</strong> ${info.path}</div>
+                                </div>
+
+                                <div class="project-actions">
+                                    <button class="btn btn-success btn-sm" onclick="updateProject('${name}')">
+                                        <i class="fas fa-sync-alt"></i> Обновить
+                                    </button>
+                                    <button class="btn btn-info btn-sm" onclick="viewProjectFiles('${name}')">
+                                        <i class="fas fa-folder-open"></i> Файлы
+                                    </button>
+                                    <button class="btn btn-warning btn-sm" onclick="viewProjectLogs('${name}')">
+                                        <i class="fas fa-file-alt"></i> Логи
+                                    </button>
+                                    <button class="btn btn-danger btn-sm" onclick="deleteProject('${name}')">
+                                        <i class="fas fa-trash"></i> Удалить
+                                    </button>
+                                </div>
+                            </div>
+                        `;
+                    }
+                    projectsList.innerHTML = html;
+                })
+                .catch(err => {
+                    document.getElementById('projectsList').innerHTML = `
+                        <div class="alert alert-error">
+                            <i class="fas fa-exclamation-triangle"></i> Ошибка загрузки проектов: ${err.message}
+                        </div>
+                    `;
+                });
+        }
+
+        // Деплой проекта
+        document.getElementById('deployForm').addEventListener('submit', function(e) {
+            e.preventDefault();
+
+            const projectName = document.getElementById('projectName').value.trim();
+            const repoUrl = document.getElementById('repoUrl').value.trim();
+            const branch = document.getElementById('branch').value.trim() || 'main';
+
+            if (!projectName || !repoUrl) {
+                showStatus('❌ Заполните все обязательные поля', 'error');
+                return;
+            }
+
+            if (!repoUrl.includes('github.com')) {
+                showStatus('❌ Поддерживается только GitHub репозитории', 'error');
+                return;
+            }
+
+            showStatus('🔄 Деплой начат... Пожалуйста, подождите.', 'info');
+
+            fetch('/api/deploy', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    project_name: projectName,
+                    repo_url: repoUrl,
+                    branch: branch
+                })
+            })
+            .then(r => r.json())
+            .then(data => {
+                if (data.error) {
+                    showStatus('❌ ' + data.error, 'error');
+                } else {
+                    showStatus('🔄 ' + data.message, 'info');
+                    document.getElementById('deployForm').reset();
+                    document.getElementById('branch').value = 'main';
+                    waitForJob(data.job_id);
+                }
+            })
+            .catch(err => showStatus('❌ Ошибка сети: ' + err.message, 'error'));
+        });
+
+        // Обновление проекта
+        function updateProject(name) {
+            showStatus(`🔄 Обновление проекта ${name}...`, 'info');
+
+            fetch(`/api/update/${name}`, { method: 'POST' })
+                .then(r => r.json())
+                .then(data => {
+                    if (data.error) {
+                        showStatus('❌ ' + data.error, 'error');
+                    } else {
+                        showStatus('🔄 ' + data.message, 'info');
+                        waitForJob(data.job_id);
+                    }
+                })
+                .catch(err => showStatus('❌ Ошибка: ' + err.message, 'error'));
+        }
+
+        // Ожидание завершения задачи деплоя: начальное состояние, дальше - события сервера
+        const trackedJobs = new Set();
+
+        function waitForJob(jobId) {
+            trackedJobs.add(jobId);
+            fetch(`/api/jobs/${jobId}`)
+                .then(r => r.json())
+                .then(job => {
+                    if (job.error && !job.status) {
+                        trackedJobs.delete(jobId);
+                        showStatus('❌ ' + job.error, 'error');
+                    } else {
+                        renderJob(job);
+                    }
+                })
+                .catch(err => showStatus('❌ Ошибка: ' + err.message, 'error'));
+        }
+
+        function renderJob(job) {
+            if (!trackedJobs.has(job.id)) {
+                return;
+            }
+            if (job.status === 'queued' || job.status === 'running') {
+                showStatus(`🔄 ${job.project}: ${job.stage || 'в очереди'}...`, 'info');
+                return;
+            }
+            trackedJobs.delete(job.id);
+            if (job.status === 'succeeded') {
+                showStatus('✅ ' + job.result.message, 'success');
+            } else {
+                showStatus(`❌ ${job.project}: ${job.error || job.status}`, 'error');
+            }
+        }
+
+        // Поток событий сервера вместо периодического опроса
+        let refreshTimer = null;
+
+        function scheduleRefresh() {
+            // Несколько событий подряд - одно обновление списка
+            clearTimeout(refreshTimer);
+            refreshTimer = setTimeout(() => {
+                loadProjects();
+                updateStats();
+            }, 500);
+        }
+
+        function formatBytes(bytes) {
+            return (bytes / 1024 / 1024).toFixed(1) + ' MB';
+        }
+
+        function appendLiveLog(line) {
+            const liveLog = document.getElementById('liveLog');
+            const lines = (liveLog.textContent + line + '\n').split('\n');
+            liveLog.textContent = lines.slice(-200).join('\n');
+            liveLog.scrollTop = liveLog.scrollHeight;
+        }
+
+        function connectEvents() {
+            const source = new EventSource('/api/events');
+
+            // После переподключения часть событий могла быть вытеснена из буфера
+            source.addEventListener('open', scheduleRefresh);
+
+            source.addEventListener('job', e => {
+                const job = JSON.parse(e.data);
+                if (!['queued', 'running'].includes(job.status)) {
+                    scheduleRefresh();
+                }
+                renderJob(job);
+            });
+
+            source.addEventListener('progress', e => {
+                const progress = JSON.parse(e.data);
+                if (trackedJobs.has(progress.id)) {
+                    const total = progress.total ? ' из ' + formatBytes(progress.total) : '';
+                    showStatus(`⬇️ ${progress.project}: ${formatBytes(progress.bytes)}${total}`, 'info');
+                }
+            });
+
+            source.addEventListener('output', e => {
+                const output = JSON.parse(e.data);
+                appendLiveLog(`[pip] ${output.project}: ${output.line}`);
+            });
+
+            source.addEventListener('log', e => {
+                const record = JSON.parse(e.data);
+                appendLiveLog(`[${record.time}] [${record.level}] ${record.message}`);
+            });
+        }
+
+        // Удаление проекта
+        function deleteProject(name) {
+            if (!confirm(`Удалить проект "${name}"?
+
+Это действие нельзя отменить!`)) {
+                return;
+            }
+
+            showStatus(`🗑️ Удаление проекта ${name}...`, 'info');
+
+            fetch(`/api/project/${name}`, { method: 'DELETE' })
+                .then(r => r.json())
+                .then(data => {
+                    if (data.error) {
+                        showStatus('❌ ' + data.error, 'error');
+                    } else {
+                        showStatus('✅ ' + data.message, 'success');
+                        loadProjects();
+                        updateStats();
+                    }
+                })
+                .catch(err => showStatus('❌ Ошибка: ' + err.message, 'error'));
+        }
+
+        // Просмотр файлов проекта
+        function viewProjectFiles(name) {
+            window.open(`/api/project/${name}/files`, '_blank');
+        }
+
+        // Просмотр логов проекта
+        function viewProjectLogs(name) {
+            window.open(`/api/project/${name}/logs`, '_blank');
+        }
+
+        // Показ статуса
+        function showStatus(message, type) {
+            const statusDiv = document.getElementById('deployStatus');
+            const colors = {
+                'success': 'alert-success',
+                'error': 'alert-error',
+                'info': 'alert-success'
+            };
+
+            statusDiv.innerHTML = `<div class="alert ${colors[type] || 'alert-success'}">${message}</div>`;
+
+            setTimeout(() => {
+                statusDiv.innerHTML = '';
+            }, 5000);
+        }
+
+        // Инициализация
+        document.addEventListener('DOMContentLoaded', function() {
+            loadProjects();
+            updateStats();
+            connectEvents();
+            setInterval(renderUptime, 1000);
+        });